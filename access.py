@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+from typing import Any, Awaitable, Callable, Dict
+
+import asyncpg
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+import db
+from metrics import ACCESS_DENIED, ALLOWED_USERS
+from throttling import insert_before_fsm
+
+logger = logging.getLogger(__name__)
+
+# Источники списка доступа (объединяются): переменная окружения, файл (id по одному в строке, # — комментарий)
+# и таблица allowed_users (миграция 6). Файл и таблица перечитываются по SIGHUP, таблица — ещё и по NOTIFY.
+ACCESS_ENV = os.getenv("ALLOWED_USERS", "")
+ACCESS_FILE = os.getenv("ACCESS_FILE", "")
+ACCESS_CHANNEL = "allowed_users"
+# Пауза перед переподключением слушателя NOTIFY, сек.
+LISTEN_RETRY = 5
+
+DENIED_TEXT = "Доступ запрещён ❌"
+
+
+def parse_ids(text: str) -> set[int]:
+    """id через запятую, пробелы или переводы строк; всё после # — комментарий"""
+    ids = set()
+    for line in text.splitlines():
+        for part in line.split("#", 1)[0].replace(",", " ").split():
+            ids.add(int(part))
+    return ids
+
+
+class AccessList:
+    """
+    Кэш списка доступа: frozenset, проверка — один lookup по хэшу.
+    Перечитывание собирает новый набор целиком и подменяет ссылку — проверки никогда не ждут загрузки.
+    """
+
+    def __init__(self, env=ACCESS_ENV, path=ACCESS_FILE):
+        self.env = env
+        self.path = path
+        self.users: frozenset[int] = frozenset(self._static())
+        self.reloads = 0
+        self._listener: asyncpg.Connection | None = None
+        self._listen_task: asyncio.Task | None = None
+        self._reloading: asyncio.Task | None = None
+        self._dirty = False
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def _static(self) -> set[int]:
+        users = parse_ids(self.env)
+        if self.path:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    users |= parse_ids(f.read())
+            except (OSError, ValueError):
+                logger.exception("access file %s not loaded", self.path)
+        return users
+
+    async def reload(self) -> frozenset[int]:
+        users = self._static()
+        if db.db_pool is not None:
+            try:
+                users |= {r["user_id"] for r in await db.fetch("SELECT user_id FROM allowed_users")}
+            except Exception:
+                # таблицы ещё нет (MIGRATE_ON_STARTUP=0) или БД недоступна — остаёмся на env и файле
+                logger.exception("allowed_users not loaded")
+        self.users = frozenset(users)
+        self.reloads += 1
+        if not self.users:
+            logger.warning("access list is empty: every update will be denied")
+        logger.info("access list: %s users", len(self.users))
+        return self.users
+
+    def schedule_reload(self, *_):
+        """Для сигналов и NOTIFY: перечитать в фоне; пачка уведомлений подряд — одно-два перечитывания"""
+        self._dirty = True
+        if self._reloading is None or self._reloading.done():
+            self._reloading = asyncio.get_running_loop().create_task(self._reload_while_dirty())
+
+    async def _reload_while_dirty(self):
+        # уведомление во время чтения — читаем ещё раз: идущее чтение могло не увидеть изменение
+        while self._dirty:
+            self._dirty = False
+            await self.reload()
+
+    # ================== Горячее обновление ==================
+    async def start(self):
+        """Загрузить список и подписаться на SIGHUP и NOTIFY allowed_users"""
+        await self.reload()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.schedule_reload)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            # Windows или не главный поток — остаётся NOTIFY
+            pass
+        self._listen_task = loop.create_task(self._listen())
+
+    async def stop(self):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            await asyncio.gather(self._listen_task, return_exceptions=True)
+            self._listen_task = None
+
+    async def _listen(self):
+        # Отдельное соединение, не из пула: LISTEN держит его всё время работы бота
+        reconnect = False
+        while True:
+            lost = asyncio.Event()
+            try:
+                self._listener = await asyncpg.connect(host=db.DB_HOST, database=db.DB_NAME, user=db.DB_USER,
+                                                       password=db.DB_PASS, port=db.DB_PORT)
+                self._listener.add_termination_listener(lambda _conn: lost.set())
+                await self._listener.add_listener(ACCESS_CHANNEL, self.schedule_reload)
+                if reconnect:
+                    # пока соединения не было, уведомления терялись
+                    self.schedule_reload()
+                await lost.wait()
+                logger.warning("access listener connection lost")
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception("access listener failed")
+            finally:
+                if self._listener is not None and not self._listener.is_closed():
+                    await self._listener.close()
+                self._listener = None
+            reconnect = True
+            await asyncio.sleep(LISTEN_RETRY)
+
+
+# ================== Middleware ==================
+class AccessMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на dp.update: апдейты от пользователей не из списка не доходят
+    ни до FSM, ни до обработчиков (включая кнопки и шаги FSM).
+    """
+
+    def __init__(self, access: AccessList):
+        self.access = access
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and user.id in self.access.users:
+            return await handler(event, data)
+
+        update_type = event.event_type
+        ACCESS_DENIED.labels(update_type).inc()
+        if update_type == "message" and user is not None:
+            username = f"@{user.username}" if user.username else user.first_name
+            await event.message.answer(f"{DENIED_TEXT} {username}")
+        elif update_type == "callback_query":
+            await event.callback_query.answer(DENIED_TEXT)
+        return None
+
+
+def setup_access(dp: Dispatcher, access: AccessList | None = None) -> AccessList:
+    """Проверка доступа перед FSM; загрузка из БД и подписки — в access.start() (на старте бота)"""
+    access = access or AccessList()
+    ALLOWED_USERS.set_function(lambda: len(access))
+    insert_before_fsm(dp, AccessMiddleware(access))
+    return access
+
+
+# ================== CLI ==================
+# python access.py list | grant ID [заметка] | revoke ID — работающие боты подхватят изменение по NOTIFY
+async def _main(args):
+    await db.create_db_pool()
+    try:
+        if args.command == "grant":
+            await db.execute("INSERT INTO allowed_users(user_id, note) VALUES($1, $2) "
+                             "ON CONFLICT (user_id) DO UPDATE SET note = COALESCE(EXCLUDED.note, allowed_users.note)",
+                             args.user_id, args.note)
+        elif args.command == "revoke":
+            await db.execute("DELETE FROM allowed_users WHERE user_id = $1", args.user_id)
+        for row in await db.fetch("SELECT user_id, note, added_at FROM allowed_users ORDER BY added_at"):
+            print(f"{row['user_id']:>14} {row['added_at']:%d.%m.%Y %H:%M} {row['note'] or ''}")
+        return 0
+    finally:
+        await db.close_db_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Список доступа к боту (таблица allowed_users)")
+    parser.add_argument("command", choices=("list", "grant", "revoke"))
+    parser.add_argument("user_id", nargs="?", type=int)
+    parser.add_argument("note", nargs="?")
+    parsed = parser.parse_args()
+    if parsed.command != "list" and parsed.user_id is None:
+        parser.error("нужен user_id")
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(parsed)))
@@ -0,0 +1,142 @@
+"""
+Стоимость диспетчеризации одного callback-апдейта: старая цепочка lambda-фильтров
+на Dispatcher против роутеров с CallbackData (callbacks.py, как в bot.py).
+
+Обработчики пустые (только разбор данных, как в bot.py), в сеть ничего не уходит.
+    python benchmarks/bench_dispatch.py [--updates 20000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, Router, F, types  # noqa: E402
+
+from callbacks import PageCb, RecCb, NavCb, PartCb, ListCb, MenuCb, prefix_filter  # noqa: E402
+
+USER_ID = 123456789
+
+
+# ================== До: цепочка lambda-фильтров (порядок как был в bot.py) ==================
+def legacy_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+
+    async def parse(call: types.CallbackQuery):
+        call.data.split("_")
+
+    dp.callback_query(lambda c: c.data and c.data.startswith("page_"))(parse)
+    dp.callback_query(lambda c: c.data and (c.data.startswith("ctx_") or c.data.startswith("view_")))(parse)
+    dp.callback_query(F.data.startswith("shows_result_ctx_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("result_add_ctx_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("delete_ctx_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("manual_move_ctx_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("back_to_list_ctx_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data == "search_all")(parse)
+    dp.callback_query(lambda c: c.data == "back")(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("read_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("delete_"))(parse)
+    dp.callback_query(lambda c: c.data and c.data.startswith("manual_move_")
+                      and not c.data.startswith("manual_move_ctx_"))(parse)
+    return dp
+
+
+CURSOR = "gxq2bp0g0_16_s"  # encode_cursor() записи spreads#42
+
+# Пары (старая кнопка, та же кнопка в новом формате) — одно и то же действие
+PAYLOAD_PAIRS = [
+    ("page_n_1700000000000000_42", PageCb(backward=False, cursor=CURSOR).pack()),
+    (f"ctx_{USER_ID}_3", RecCb(action="v", cat="s", id=42, page=CURSOR).pack()),
+    (f"shows_result_ctx_{USER_ID}_3", RecCb(action="r", cat="s", id=42).pack()),
+    (f"result_add_ctx_{USER_ID}_3", RecCb(action="a", cat="s", id=42).pack()),
+    (f"delete_ctx_{USER_ID}_3", RecCb(action="d", cat="s", id=42).pack()),
+    (f"manual_move_ctx_{USER_ID}_3", RecCb(action="m", cat="s", id=42).pack()),
+    (f"back_to_list_ctx_{USER_ID}", ListCb(page=CURSOR).pack()),
+    ("search_all", MenuCb(action="search").pack()),
+    ("back", MenuCb(action="home").pack()),
+    # кнопки, открытые из результатов поиска (page=s)
+    ("read_spreads_42_3", RecCb(action="v", cat="s", id=42, page="s").pack()),
+    ("delete_spreads_42_3", RecCb(action="d", cat="s", id=42, page="s").pack()),
+    ("manual_move_spreads_42_3", RecCb(action="m", cat="s", id=42, page="s").pack()),
+]
+
+
+# ================== После: роутеры и CallbackData ==================
+def routed_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    list_router = Router(name="list")
+    list_router.callback_query.filter(prefix_filter(PageCb, ListCb, MenuCb))
+    record_router = Router(name="record")
+    record_router.callback_query.filter(prefix_filter(RecCb, NavCb, PartCb))
+
+    async def noop(call: types.CallbackQuery, callback_data):
+        pass
+
+    list_router.callback_query(PageCb.filter())(noop)
+    list_router.callback_query(ListCb.filter())(noop)
+    list_router.callback_query(MenuCb.filter(F.action == "search"))(noop)
+    list_router.callback_query(MenuCb.filter(F.action == "home"))(noop)
+    for action in ("v", "r", "a", "d", "m"):
+        record_router.callback_query(RecCb.filter(F.action == action))(noop)
+    record_router.callback_query(NavCb.filter())(noop)
+    record_router.callback_query(PartCb.filter())(noop)
+    dp.include_routers(list_router, record_router)
+    return dp
+
+
+# Кнопки, которых раньше не было: соседняя запись по курсору и страницы длинной карточки
+ROUTED_ONLY = [
+    NavCb(backward=False, cursor=CURSOR).pack(),
+    NavCb(backward=True, cursor=CURSOR, page="s").pack(),
+    PartCb(cat="s", id=42, part=1).pack(),
+]
+
+
+def make_update(update_id, data):
+    user = types.User(id=USER_ID, is_bot=False, first_name="bench")
+    chat = types.Chat(id=USER_ID, type="private")
+    message = types.Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text="Выберите запись:")
+    return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance="bench", message=message, data=data
+    ))
+
+
+async def measure(dp, bot, payloads, n):
+    """Средняя стоимость апдейта (мкс) по каждому payload"""
+    result = {}
+    for data in payloads:
+        updates = [make_update(i, data) for i in range(n)]
+        for update in updates[:100]:  # прогрев
+            await dp.feed_update(bot, update)
+        started = time.perf_counter()
+        for update in updates:
+            await dp.feed_update(bot, update)
+        result[data] = (time.perf_counter() - started) / n * 1e6
+    return result
+
+
+async def main(n):
+    bot = Bot(token="42:BENCHMARK")
+    try:
+        before = await measure(legacy_dispatcher(), bot, [old for old, _ in PAYLOAD_PAIRS], n)
+        after = await measure(routed_dispatcher(), bot, [new for _, new in PAYLOAD_PAIRS] + ROUTED_ONLY, n)
+    finally:
+        await bot.session.close()
+
+    print(f"{'#':>4}  {'до, мкс':>10}  {'после, мкс':>10}  payload")
+    for i, (old, new) in enumerate(PAYLOAD_PAIRS, 1):
+        print(f"{i:>4}  {before[old]:>10.1f}  {after[new]:>10.1f}  {old} → {new}")
+    for new in ROUTED_ONLY:
+        print(f"{'':>4}  {'—':>10}  {after[new]:>10.1f}  {new}")
+    avg_before = sum(before[old] for old, _ in PAYLOAD_PAIRS) / len(PAYLOAD_PAIRS)
+    avg_after = sum(after[new] for _, new in PAYLOAD_PAIRS) / len(PAYLOAD_PAIRS)
+    print(f"среднее по парам: {avg_before:.1f} мкс → {avg_after:.1f} мкс на апдейт "
+          f"({len(PAYLOAD_PAIRS)} одинаковых действий)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", type=int, default=20000, help="апдейтов на каждый payload")
+    asyncio.run(main(parser.parse_args().updates))
@@ -0,0 +1,100 @@
+"""
+Стоимость карточки записи: прежний format_record (конкатенация и ветки по категориям, без экранирования)
+против renderer.py (шаблоны, собранные при импорте, один join, экранирование HTML, разбиение по лимиту Telegram).
+
+Без сети и БД; на записях без спецсимволов HTML тексты обоих вариантов должны совпадать.
+    python benchmarks/bench_render.py [--number 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from renderer import MESSAGE_LIMIT, render_record, render_record_pages  # noqa: E402
+
+
+# ================== До: format_record из functions.py ==================
+def legacy_format_record(record, category, result=None):
+    text = f"📌 <b>{record.get('title','Без названия')}</b>\n"
+    text += f"🗓 Дата: {record['created_at'].strftime('%d.%m.%Y %H:%M')}\n"
+
+    if category == "spreads":
+        text += f"❓ Вопрос: {record.get('question')}\n"
+        text += f"🃏 Карты: {record.get('cards')}\n"
+        text += f"📝 Трактовка: {record.get('interpretation')}\n"
+    elif category == "dreams":
+        text += f"💤 Сон: {record.get('dream_text')}\n"
+        text += f"📝 Трактовка: {record.get('interpretation')}\n"
+    elif category == "premonitions":
+        text += f"🔮 Предчувствие: {record.get('premonition_text')}\n"
+        text += f"📝 Трактовка: {record.get('interpretation')}\n"
+    elif category == "rituals":
+        text += f"🎯 Цель: {record.get('purpose')}\n"
+        text += f"🛠 Инструменты: {record.get('tools')}\n"
+        text += f"⚡ Действия: {record.get('action')}\n"
+        text += f"💫 Ощущения: {record.get('feelings')}\n"
+
+    if result:
+        text += f"\n🎯 Итог: {result.get('result_text')}"
+
+    return text
+
+
+# ================== Записи ==================
+WORDS = "луна свеча карта башня туз кубков сон дорога вода огонь ключ зеркало".split()
+
+
+def words(n, special=False):
+    text = " ".join(WORDS[i % len(WORDS)] for i in range(n))
+    # то, что раньше ломало разметку: <, >, &
+    return text + " <3 & Ко > всех" if special else text
+
+
+def sample_records(special=False):
+    now = datetime(2024, 3, 1, 21, 30)
+    return {
+        "spreads (короткий)": ("spreads", {
+            "title": "Расклад на неделю", "created_at": now, "question": words(8, special),
+            "cards": "Башня, Звезда, Туз кубков", "interpretation": words(40, special),
+        }),
+        "dreams (средний)": ("dreams", {
+            "title": "Сон про дом", "created_at": now, "dream_text": words(150, special),
+            "interpretation": words(80, special),
+        }),
+        "rituals (длинный)": ("rituals", {
+            "title": "Ритуал полнолуния", "created_at": now, "purpose": words(30, special),
+            "tools": words(20, special), "action": words(900, special), "feelings": words(300, special),
+        }),
+    }
+
+
+def bench(fn, number):
+    """Среднее время вызова, мкс (лучший из 5 прогонов)"""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main(number):
+    for name, (table, record) in sample_records().items():
+        assert render_record(record, table) == legacy_format_record(record, table), name
+
+    # «с < & >» — экранирование идёт медленным путём; прежняя функция такой текст просто ломала
+    print(f"{'запись':<20} {'текст':<7} {'символов':>9} {'страниц':>8} {'до, мкс':>9} {'после, мкс':>11} "
+          f"{'с разбиением':>13}")
+    for special in (False, True):
+        for name, (table, record) in sample_records(special).items():
+            pages = render_record_pages(record, table)
+            assert all(len(page) <= MESSAGE_LIMIT for page in pages), name
+            before = bench(lambda: legacy_format_record(record, table), number)
+            after = bench(lambda: render_record(record, table), number)
+            split = bench(lambda: render_record_pages(record, table), number)
+            print(f"{name:<20} {'< & >' if special else 'обычный':<7} {len(render_record(record, table)):>9} "
+                  f"{len(pages):>8} {before:>9.2f} {after:>11.2f} {split:>13.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="вызовов в одном прогоне")
+    main(parser.parse_args().number)
@@ -0,0 +1,77 @@
+"""
+Локальная подмена Bot API для бенчмарков: отвечает на методы, которые зовёт бот,
+и запоминает последнюю клавиатуру в каждом чате — по ней сценарии «нажимают» кнопки.
+"""
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.last_markup: dict[int, list[list[dict]]] = {}
+        self.last_text: dict[int, str] = {}
+        self._message_id = 0
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        # порт 0 — выбрала ОС
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def buttons(self, chat_id) -> list[dict]:
+        return [button for row in self.last_markup.get(chat_id, []) for button in row]
+
+    # ================== Методы Bot API ==================
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            self.last_text[chat_id] = params.get("text", "")
+            markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else {}
+            # reply-клавиатура (главное меню) не заменяет последнюю инлайн-клавиатуру
+            if "inline_keyboard" in markup or method == "editMessageText":
+                self.last_markup[chat_id] = markup.get("inline_keyboard", [])
+            return self._ok(self._message(chat_id, params))
+        if method == "getMe":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        # answerCallbackQuery, deleteMessage и прочее
+        return self._ok(True)
+
+    def _message(self, chat_id, params):
+        if "message_id" in params:
+            message_id = int(params["message_id"])
+        else:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "bench"},
+            "text": params.get("text", ""),
+        }
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
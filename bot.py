@@ -1,48 +1,62 @@
 import os
+import time
 import asyncio
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, types, filters, F
+from aiogram import Bot, Dispatcher, Router, types, filters, F
 from aiogram.client.bot import DefaultBotProperties
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 
 # Импорты твоих модулей — ориентируйся как у тебя
-from db import create_db_pool, add_record, get_records, get_record_by_id, delete_record, update_record_datetime, \
-    get_result, add_result, get_our_result
+from db import create_db_pool, add_record, delete_record, update_record_datetime, add_result, \
+    get_our_result, get_record_by_id, get_record_with_result, get_timeline_page, \
+    search_timeline, search_timeline_fuzzy, close_db_pool, start_write_queue, WRITE_BATCHING
 from states import Form
-from functions import main_keyboard, category_keyboard, format_record, CATEGORY_TABLE
+from callbacks import PageCb, RecCb, NavCb, PartCb, ListCb, MenuCb, SEARCH_PAGE, record_cb, prefix_filter
+from context_store import NavItem, TABLE_CATEGORY
+from export import export_diary, parse_export_args
+from importer import import_file, ImportFileError
+from storage import create_storages
+from migrations import migrate, MIGRATE_ON_STARTUP
+from metrics import setup_metrics, serve_metrics
+from slowlog import setup_slow_query_log
+from renderer import render_record_pages, render_result_pages
+from throttling import setup_throttling
+from access import setup_access
+from singleflight import SingleFlight
+from functions import main_keyboard, category_keyboard, encode_cursor, decode_cursor, TABLE_CODE, CODE_TABLE
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-ALLOWED_USERS = list(map(int, os.getenv("ALLOWED_USERS").split(',')))
 
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher(storage=MemoryStorage())
 
 # ---------------------------
-# In-memory user contexts:
-# USER_CONTEXT[user_id] = [ {"table": "...", "id": 123, "title": "...", "created_at": datetime, "category": "...", "raw": {...}}, ... ]
+# FSM и контексты пользователей (STORAGE_BACKEND: memory / redis / postgres, см. storage.py).
+# Кнопки записей самодостаточны (см. callbacks.py); в USER_CONTEXT остаются только результаты поиска:
+# await USER_CONTEXT.get(user_id) -> UserContext(items=[NavItem(table, id, title, created_at), ...])
 # ---------------------------
-USER_CONTEXT: dict[int, list[dict]] = {}
+fsm_storage, USER_CONTEXT = create_storages()
+dp = Dispatcher(storage=fsm_storage)
 
-
-# ================== Проверка пользователя ==================
-async def check_user(message: types.Message):
-    if message.from_user.id not in ALLOWED_USERS:
-        username = f"@{message.from_user.username}" if message.from_user.username else message.from_user.first_name
-        await message.answer(f"Доступ запрещён ❌ {username}")
-        return False
-    return True
+# ---------------------------
+# Роутеры инлайн-кнопок (см. callbacks.py): роутер пропускается целиком, если префикс не его,
+# разбор callback_data — один раз, в CallbackData.filter()
+# ---------------------------
+list_router = Router(name="list")
+list_router.callback_query.filter(prefix_filter(PageCb, ListCb, MenuCb))
+record_router = Router(name="record")
+record_router.callback_query.filter(prefix_filter(RecCb, NavCb, PartCb))
 
 
 # ================== Старт ==================
 @dp.message(filters.Command("start"))
-async def start(message: types.Message):
-    if not await check_user(message):
-        return
+async def start(message: types.Message, state: FSMContext):
+    # /start — ещё и отмена любого начатого ввода (импорт, запись, поиск)
+    await state.clear()
     username = f"{message.from_user.first_name}" if message.from_user.first_name else message.from_user.username
     await message.answer(f"Приветик! {username}❤️ Что будем делать?", reply_markup=main_keyboard())
 
@@ -50,8 +64,6 @@ async def start(message: types.Message):
 # ================== Главное меню: Записать ==================
 @dp.message(lambda message: message.text == "Записать")
 async def write_menu(message: types.Message, state: FSMContext):
-    if not await check_user(message):
-        return
     await state.set_state(Form.category)
     await message.answer("Выбери категорию для записи:", reply_markup=category_keyboard())
 
@@ -59,84 +71,224 @@ async def write_menu(message: types.Message, state: FSMContext):
 # ================== Главное меню: Прочитать ==================
 @dp.message(lambda message: message.text == "Прочитать")
 async def read_menu(message: types.Message):
-    if not await check_user(message):
-        return
     await show_records_menu(message)  # покажем агрегированный список (все таблицы)
 
 
-# ================== Показ списка записей (агрегированный или по поиску) ==================
-async def show_records_menu(call_or_message, search_query: str | None = None):
+# ================== Экспорт дневника ==================
+@dp.message(filters.Command("export"))
+async def export_command(message: types.Message):
+    try:
+        fmt, tables, date_from, date_to = parse_export_args(message.text)
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+
+    await message.answer("Готовлю файл… ⏳")
+    stats = await export_diary(message.from_user.id, fmt, tables, date_from, date_to)
+    try:
+        if not stats.rows:
+            await message.answer("Нет записей для экспорта.")
+            return
+        await message.answer_document(
+            FSInputFile(stats.path, filename=f"diary_{datetime.now():%Y%m%d}.{fmt}.gz"),
+            caption=f"Записей: {stats.rows} ({stats.seconds:.1f} с, {stats.rows_per_second:.0f} строк/с)"
+        )
+    finally:
+        os.remove(stats.path)
+
+
+# ================== Импорт записей ==================
+@dp.message(filters.Command("import"))
+async def import_command(message: types.Message, state: FSMContext):
+    await state.set_state(Form.import_file)
+    await message.answer(
+        "Пришлите файл .csv или .jsonl (можно .gz).\n"
+        "Колонки: category (Расклад/Сон/Предчувствие/Ритуал), title, created_at (ДД.ММ.ГГГГ ЧЧ:ММ) "
+        "и поля категории — как в файле из /export."
+    )
+
+
+@dp.message(Form.import_file)
+async def import_file_input(message: types.Message, state: FSMContext):
+    if not message.document:
+        await message.answer("Нужен файл. Пришлите документ или /start для отмены.")
+        return
+    await state.clear()
+
+    # по расширению importer выбирает формат (.csv / .jsonl / .gz)
+    fd, path = tempfile.mkstemp(suffix=f"_{os.path.basename(message.document.file_name or 'import.csv')}")
+    os.close(fd)
+    status = await message.answer("Загружаю… ⏳")
+    last_update = time.monotonic()
+
+    async def progress(report):
+        nonlocal last_update
+        # не чаще раза в пару секунд, чтобы не упереться в лимиты Telegram
+        if time.monotonic() - last_update < 2:
+            return
+        last_update = time.monotonic()
+        await status.edit_text(f"Обработано строк: {report.rows}, загружено: {report.imported}, "
+                               f"отклонено: {report.rejected} ⏳")
+
+    try:
+        await bot.download(message.document, destination=path)
+        report = await import_file(path, message.from_user.id, progress=progress)
+    except ImportFileError as e:
+        await status.edit_text(f"Импорт прерван ❌: {e}\nЗагружено до ошибки: {e.report.imported}", parse_mode=None)
+        return
+    finally:
+        os.remove(path)
+
+    text = f"Импорт завершён ✅ за {report.seconds:.1f} с\nЗагружено: {report.imported}\nОтклонено: {report.rejected}"
+    if report.errors:
+        text += "\n\n" + "\n".join(report.errors)
+    await status.edit_text(text, parse_mode=None)
+
+
+# ================== Поиск записей ==================
+async def find_records(user_id: int, query: str) -> list[dict]:
+    """Полнотекстовый поиск; если он ничего не дал — нечёткий (опечатки, части слов)"""
+    found = await search_timeline(user_id, query)
+    if not found:
+        found = await search_timeline_fuzzy(user_id, query)
+    return found
+
+
+# ================== Клавиатура списка записей ==================
+def build_list_kb(items: list[NavItem], page: tuple[str | None, str | None] | None = None,
+                  origin: str = "", search: bool = True) -> InlineKeyboardMarkup:
+    """
+    Кнопки RecCb(v) по видимым записям; origin — куда вернёт «Назад к списку» (RecCb.page).
+    page — (курсор предыдущей, курсор следующей страницы), None если пагинации нет.
+    """
+    buttons: list[list[InlineKeyboardButton]] = []
+    for item in items:
+        date_str = item.created_at.strftime("%d.%m.%Y")
+        buttons.append([InlineKeyboardButton(
+            text=f"{item.category} — {item.title} — {date_str}",
+            callback_data=record_cb("v", item.table, item.id, origin)
+        )])
+
+    if page:
+        prev_cursor, next_cursor = page
+        nav_row: list[InlineKeyboardButton] = []
+        if prev_cursor:
+            nav_row.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=PageCb(backward=True, cursor=prev_cursor).pack()))
+        if next_cursor:
+            nav_row.append(InlineKeyboardButton(text="Старше ➡️", callback_data=PageCb(backward=False, cursor=next_cursor).pack()))
+        if nav_row:
+            buttons.append(nav_row)
+
+    # Поиск (глобальный по всем записям) и Главное меню
+    if search:
+        buttons.append([InlineKeyboardButton(text="🔍 Поиск", callback_data=MenuCb(action="search").pack())])
+    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data=MenuCb(action="home").pack())])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# ================== Показ списка записей (постранично или по поиску) ==================
+# Одинаковые загрузки списка (тот же пользователь, та же страница или поисковый запрос) идут в БД один раз;
+# показывает результат только последний по времени запрос пользователя (см. singleflight.py)
+LIST_LOADS = SingleFlight("list")
+
+
+async def load_timeline(user_id: int, cursor: tuple | None, backward: bool, inclusive: bool):
+    """Страница ленты: (строки, курсоры соседних страниц или None, origin)"""
+    page = None
+    origin = ""
+
+    # Одна страница по всем таблицам (PAGE_SIZE + 1 строка для проверки продолжения)
+    aggregated, has_more = await get_timeline_page(user_id, cursor, backward, inclusive=inclusive)
+    if not aggregated and cursor is not None:
+        # страница опустела (записи удалены/перенесены) — начинаем сначала
+        cursor, backward = None, False
+        aggregated, has_more = await get_timeline_page(user_id)
+
+    has_prev = has_more if backward else cursor is not None
+    has_next = True if backward else has_more
+    if aggregated:
+        first, last = aggregated[0], aggregated[-1]
+        page = (
+            encode_cursor(first["created_at"], first["id"], first["table"]) if has_prev else None,
+            encode_cursor(last["created_at"], last["id"], last["table"]) if has_next else None,
+        )
+        origin = page[0] or ""
+    # общего числа записей в заголовке нет: count(*) растёт с числом записей, а страница — нет
+    return aggregated, page, origin
+
+
+async def show_records_menu(call_or_message, search_query: str | None = None,
+                            cursor: tuple | None = None, backward: bool = False, inclusive: bool = False):
     """
     Если вызывается из Message — show as message.answer,
     если из CallbackQuery — edit message with inline keyboard.
 
-    Формирует USER_CONTEXT[user_id] — список видимых записей (для навигации).
-    Кнопки используют callback_data формата: ctx_{user_id}_{index}
+    Кнопки записей — RecCb(v, таблица, id), листание страниц — PageCb (см. callbacks.py).
+    Страницу ленты можно восстановить по её верхней записи (inclusive=True) — так работает
+    «Назад к списку»; в USER_CONTEXT сохраняются только результаты поиска.
     """
     user_id = call_or_message.from_user.id
-    aggregated: list[dict] = []
-
-    # Собираем все записи по всем таблицам
-    for category, table in CATEGORY_TABLE.items():
-        rows = await get_records(table, user_id)
-        for row in rows:
-            aggregated.append({
-                "table": table,
-                "id": row["id"],
-                "title": row.get("title") or "",
-                "created_at": row["created_at"],
-                "raw": row,
-                "category": category
-            })
-
-    # Применяем поиск, если есть
-    if search_query:
-        q = search_query.lower()
-        filtered = []
-        for item in aggregated:
-            row = item["raw"]
-            found = False
-            for v in row.values():
-                if isinstance(v, str) and q in v.lower():
-                    found = True
-                    break
-            if found:
-                filtered.append(item)
-        aggregated = filtered
-
-    # Сохраняем в контексте пользователя
-
-    # сортируем по created_at перед сохранением !!!!!!!!!!
-    aggregated.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-
-    USER_CONTEXT[user_id] = aggregated
-
-
-    if not aggregated:
+    ticket = LIST_LOADS.begin(user_id)
+    try:
+        if search_query:
+            aggregated = await LIST_LOADS.do((user_id, "search", search_query),
+                                             lambda: find_records(user_id, search_query))
+            page, origin = None, SEARCH_PAGE
+        else:
+            aggregated, page, origin = await LIST_LOADS.do(
+                (user_id, "timeline", cursor, backward, inclusive),
+                lambda: load_timeline(user_id, cursor, backward, inclusive))
+
+        # пока грузили, пользователь запросил другой список — его и покажет более новый вызов
+        if not LIST_LOADS.is_latest(user_id, ticket):
+            return
+        if search_query:
+            await USER_CONTEXT.set(user_id, aggregated)
+
+        items = [NavItem.from_row(row) for row in aggregated]
+        if not items:
+            if isinstance(call_or_message, types.CallbackQuery):
+                await call_or_message.message.edit_text("Нет записей для чтения.", reply_markup=None)
+            else:
+                await call_or_message.answer("Нет записей для чтения.", reply_markup=main_keyboard())
+            return
+
+        kb = build_list_kb(items, page, origin)
         if isinstance(call_or_message, types.CallbackQuery):
-            await call_or_message.message.edit_text("Нет записей для чтения.", reply_markup=None)
+            await call_or_message.message.edit_text("Выберите запись:", reply_markup=kb)
         else:
-            await call_or_message.answer("Нет записей для чтения.", reply_markup=main_keyboard())
-        return
+            await call_or_message.answer("Выберите запись:", reply_markup=kb)
+    finally:
+        LIST_LOADS.end(user_id, ticket)
+
+
+async def show_list(call: types.CallbackQuery, origin: str):
+    """Список, из которого была открыта запись (origin — RecCb.page)"""
+    if origin == SEARCH_PAGE:
+        ctx = await USER_CONTEXT.get(call.from_user.id)
+        if ctx and ctx.items:
+            kb = build_list_kb(ctx.items, origin=SEARCH_PAGE, search=False)
+            await call.message.edit_text(f"Найдено записей: {len(ctx.items)}", reply_markup=kb)
+            return
+        origin = ""  # результаты поиска устарели — показываем ленту
+    try:
+        cursor = decode_cursor(origin) if origin else None
+    except ValueError:
+        cursor = None
+    await show_records_menu(call, cursor=cursor, inclusive=True)
 
-    # Формируем инлайн-кнопки (по агрегированному списку)
-    buttons: list[list[InlineKeyboardButton]] = []
-    for idx, item in enumerate(aggregated):
-        cat = item["category"]
-        title = item["title"]
-        date_str = item["created_at"].strftime("%d.%m.%Y")
-        text = f"{cat} — {title} — {date_str}"
-        buttons.append([InlineKeyboardButton(text=text, callback_data=f"ctx_{user_id}_{idx}")])
 
-    # Поиск (глобальный по всем записям) и Главное меню
-    buttons.append([InlineKeyboardButton(text="🔍 Поиск", callback_data="search_all")])
-    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="back")])
+# ================== Листание списка ==================
+@list_router.callback_query(PageCb.filter())
+async def records_page_callback(call: types.CallbackQuery, callback_data: PageCb):
+    try:
+        cursor = decode_cursor(callback_data.cursor)
+    except ValueError:
+        await call.answer("Неверные данные.")
+        return
 
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-    if isinstance(call_or_message, types.CallbackQuery):
-        await call_or_message.message.edit_text("Выберите запись:", reply_markup=kb)
-    else:
-        await call_or_message.answer("Выберите запись:", reply_markup=kb)
+    await call.answer()
+    await show_records_menu(call, cursor=cursor, backward=callback_data.backward)
 
 
 # ================== FSM: Выбор категории (запись) ==================
@@ -284,162 +436,159 @@ async def ritual_feelings(message: types.Message, state: FSMContext):
     await message.answer(f"Ритуал сохранён ✅, {username}", reply_markup=main_keyboard())
     await state.clear()
 
-# ================== Просмотр записи из контекста ==================
-@dp.callback_query(lambda c: c.data and (c.data.startswith("ctx_") or c.data.startswith("view_")))
-async def read_record_ctx(call: types.CallbackQuery):
+# ================== Просмотр записи ==================
+async def show_record(call: types.CallbackQuery, table: str, record_id: int, origin: str = "", part: int = 0):
     """
-    Обработка просмотра записи из контекста (ctx_{user_id}_{index})
-    Навигация и операции опираются на USER_CONTEXT[user_id].
+    Карточка записи. Все кнопки несут таблицу и id (и origin для возврата к списку),
+    так что тап по ним не зависит от того, какой список сейчас в памяти.
+    Длиннее лимита Telegram — показывается по страницам (part), с кнопками «Назад»/«Продолжение».
     """
-    data = call.data
-    parts = data.split("_")
-    if len(parts) < 3:
-        await call.answer("Неверные данные.")
-        return
-    try:
-        _prefix, user_id_str, idx_str = parts[0], parts[1], parts[2]
-        user_id = int(user_id_str)
-        index = int(idx_str)
-    except Exception:
-        await call.answer("Неверные данные.")
-        return
-
-    # безопасность: только тот, кто запрашивал контекст, может им пользоваться
-    if call.from_user.id != user_id:
-        await call.answer("Этот список не принадлежит вам.", show_alert=True)
-        return
-
-    ctx_list = USER_CONTEXT.get(user_id, [])
-    if not ctx_list or index < 0 or index >= len(ctx_list):
-        await call.answer("Запись не найдена в текущем списке.")
-        return
-
-    item = ctx_list[index]
-    table = item["table"]
-    record_id = item["id"]
-
-    # Получаем свежую запись из БД
-    record = await get_record_by_id(table, record_id)
-    if not record:
+    # Запись и её последний итог — одним запросом
+    record, result = await get_record_with_result(table, record_id)
+    if not record or record["user_id"] != call.from_user.id:
         await call.answer("Запись не найдена (удалена?).")
-        # обновим контекст меню
-        await show_records_menu(call)
+        await show_list(call, origin)
         return
 
-    text = format_record(record, table)
+    pages = render_record_pages(record, table)
+    part = min(max(part, 0), len(pages) - 1)
+    cursor = encode_cursor(record["created_at"], record["id"], table)
 
-    # Кнопки: навигация по ctx list (стрелки), delete, move date, back to list
+    # Кнопки: страницы карточки, соседние записи списка (ищутся при нажатии, см. NavCb), delete, move date,
+    # итог, back to list
     buttons: list[list[InlineKeyboardButton]] = []
-    nav_row: list[InlineKeyboardButton] = []
-    if index > 0:
-        nav_row.append(InlineKeyboardButton(
-            text="◀️ Предыдущая",
-            callback_data=f"ctx_{user_id}_{index-1}"
-        ))
-    if index < len(ctx_list) - 1:
-        nav_row.append(InlineKeyboardButton(
-            text="Следующая ▶️",
-            callback_data=f"ctx_{user_id}_{index+1}"
-        ))
-    if nav_row:
-        buttons.append(nav_row)
-
-    # операции: delete и move (контекстные версии) + кнопка итога
-    buttons.append([
-        InlineKeyboardButton(text="❌ Удалить", callback_data=f"delete_ctx_{user_id}_{index}"),
-        InlineKeyboardButton(text="📆 Перенести дату", callback_data=f"manual_move_ctx_{user_id}_{index}")
-    ])
+    if len(pages) > 1:
+        code = TABLE_CODE[table]
+        part_row: list[InlineKeyboardButton] = []
+        if part > 0:
+            part_row.append(InlineKeyboardButton(
+                text=f"⬅️ Назад ({part}/{len(pages)})",
+                callback_data=PartCb(cat=code, id=record_id, part=part - 1, page=origin).pack()))
+        if part < len(pages) - 1:
+            part_row.append(InlineKeyboardButton(
+                text=f"Продолжение ➡️ ({part + 2}/{len(pages)})",
+                callback_data=PartCb(cat=code, id=record_id, part=part + 1, page=origin).pack()))
+        buttons.append(part_row)
+    buttons += [[
+        InlineKeyboardButton(text="◀️ Предыдущая",
+                             callback_data=NavCb(backward=True, cursor=cursor, page=origin).pack()),
+        InlineKeyboardButton(text="Следующая ▶️",
+                             callback_data=NavCb(backward=False, cursor=cursor, page=origin).pack()),
+    ], [
+        InlineKeyboardButton(text="❌ Удалить", callback_data=record_cb("d", table, record_id, origin)),
+        InlineKeyboardButton(text="📆 Перенести дату", callback_data=record_cb("m", table, record_id, origin)),
+    ]]
     # Итог
-    result_text = await get_result(table, record_id)
-
-    if result_text:
+    if result:
         buttons.append([
-            InlineKeyboardButton(
-                text="📄 Просмотреть итог",
-                callback_data=f"shows_result_ctx_{user_id}_{index}"
-
-            ),
-            InlineKeyboardButton(
-                text="✏️ Перезаписать итог",
-                callback_data=f"result_add_ctx_{user_id}_{index}"
-            )
+            InlineKeyboardButton(text="📄 Просмотреть итог", callback_data=record_cb("r", table, record_id, origin)),
+            InlineKeyboardButton(text="✏️ Перезаписать итог", callback_data=record_cb("a", table, record_id, origin)),
         ])
     else:
         buttons.append([
-            InlineKeyboardButton(
-                text="➕ Добавить итог",
-                callback_data=f"result_add_ctx_{user_id}_{index}"
-            )
+            InlineKeyboardButton(text="➕ Добавить итог", callback_data=record_cb("a", table, record_id, origin))
         ])
 
-    # Назад к списку (контекст)
-    buttons.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=f"back_to_list_ctx_{user_id}")])
+    # Назад к списку
+    buttons.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data=ListCb(page=origin).pack())])
 
     kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await call.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+    await call.message.edit_text(pages[part], parse_mode="HTML", reply_markup=kb)
 
-# ПРОБУЕМ ИТОГИ
-# Просмотр итога (robust parsing)
-import re
 
-# ================== Просмотр Итога ==================
+async def owned_record(call: types.CallbackQuery, callback_data: RecCb):
+    """(table, record) из кнопки, если запись есть и принадлежит нажавшему; иначе отвечает сам и (None, None)"""
+    table = CODE_TABLE.get(callback_data.cat)
+    record = await get_record_by_id(table, callback_data.id) if table else None
+    if record is None or record["user_id"] != call.from_user.id:
+        await call.answer("Запись не найдена.", show_alert=True)
+        return None, None
+    return table, record
 
-@dp.callback_query(F.data.startswith("shows_result_ctx_"))
-async def view_result_ctx(call: types.CallbackQuery):
-    await call.answer()  # подтверждаем callback
 
-    parts = call.data.split("_")  # ['show', 'result', 'ctx', user_id, index]
+@record_router.callback_query(RecCb.filter(F.action == "v"))
+async def read_record(call: types.CallbackQuery, callback_data: RecCb):
+    table = CODE_TABLE.get(callback_data.cat)
+    if table is None:
+        await call.answer("Неверные данные.")
+        return
+    await show_record(call, table, callback_data.id, callback_data.page)
+
+
+# ================== Страницы длинной записи ==================
+@record_router.callback_query(PartCb.filter())
+async def record_part(call: types.CallbackQuery, callback_data: PartCb):
+    table = CODE_TABLE.get(callback_data.cat)
+    if table is None:
+        await call.answer("Неверные данные.")
+        return
+    await call.answer()
+    await show_record(call, table, callback_data.id, callback_data.page, callback_data.part)
+
+
+# ================== Соседняя запись (keyset по created_at, id, таблица) ==================
+@record_router.callback_query(NavCb.filter())
+async def neighbour_record(call: types.CallbackQuery, callback_data: NavCb):
     try:
-        user_id = int(parts[3])
-        index = int(parts[4])
-    except (IndexError, ValueError):
-        await call.message.answer("Неверные данные hhh.")
+        cursor = decode_cursor(callback_data.cursor)
+    except ValueError:
+        await call.answer("Неверные данные.")
         return
 
-    if call.from_user.id != user_id:
-        await call.message.answer("Это не ваш результат.")
+    if callback_data.page == SEARCH_PAGE:
+        await neighbour_search_result(call, cursor, callback_data.backward)
         return
 
-    ctx_list = USER_CONTEXT.get(user_id, [])
-    if index >= len(ctx_list):
-        await call.message.answer("Запись не найдена.")
+    items, _ = await get_timeline_page(call.from_user.id, cursor, callback_data.backward, limit=1)
+    if not items:
+        await call.answer("Это самая новая запись." if callback_data.backward else "Это самая старая запись.")
+        return
+    await show_record(call, items[0]["table"], items[0]["id"], callback_data.page)
+
+
+async def neighbour_search_result(call: types.CallbackQuery, cursor: tuple, backward: bool):
+    """Соседняя запись в результатах поиска (порядок — по релевантности, а не по дате)"""
+    ctx = await USER_CONTEXT.get(call.from_user.id)
+    # запись ищем по курсору (created_at, id, table): он уже есть в кнопке
+    index = next((i for i, item in enumerate(ctx.items if ctx else [])
+                  if (item.created_at, item.id, item.table) == cursor), None)
+    if index is None:
+        await call.answer("Результаты поиска устарели — найдите заново.", show_alert=True)
         return
+    index += -1 if backward else 1
+    if not 0 <= index < len(ctx.items):
+        await call.answer("Это первая найденная запись." if backward else "Это последняя найденная запись.")
+        return
+    item = ctx.items[index]
+    await show_record(call, item.table, item.id, SEARCH_PAGE)
+
 
-    entry = ctx_list[index]
-    record_id = entry["id"]
-    category = entry.get("category")  # если есть
+# ================== Просмотр Итога ==================
+@record_router.callback_query(RecCb.filter(F.action == "r"))
+async def view_result(call: types.CallbackQuery, callback_data: RecCb):
+    table, record = await owned_record(call, callback_data)
+    if record is None:
+        return
+    await call.answer()  # подтверждаем callback
 
-    result = await get_our_result(user_id, record_id, category_name=category)
+    result = await get_our_result(call.from_user.id, record["id"], category_name=table)
     if not result:
         await call.message.answer("Итог не найден.")
         return
 
-    text = f"<b>Итог:</b>\n{result['result_text']}"
-    await call.message.answer(text, parse_mode="HTML")
+    for page in render_result_pages(result["result_text"]):
+        await call.message.answer(page, parse_mode="HTML")
 
 
 # Перезапись
-@dp.callback_query(lambda c: c.data and c.data.startswith("result_add_ctx_"))
-async def result_add_ctx(call: types.CallbackQuery, state: FSMContext):
-    parts = call.data.split("_")
-    user_id = int(parts[3])
-    index = int(parts[4])
-
-    if call.from_user.id != user_id:
-        await call.answer("Нельзя менять чужой результат.", show_alert=True)
+@record_router.callback_query(RecCb.filter(F.action == "a"))
+async def result_add(call: types.CallbackQuery, callback_data: RecCb, state: FSMContext):
+    table, record = await owned_record(call, callback_data)
+    if record is None:
         return
 
-    ctx_list = USER_CONTEXT.get(user_id, [])
-    if not ctx_list or index >= len(ctx_list):
-        await call.answer("Запись не найдена.", show_alert=True)
-        return
-
-    entry = ctx_list[index]
-    table = entry["table"]
-    record_id = entry["id"]
-    category = entry["category"]  # добавляем категорию для add_result
-
-    await state.update_data(result_ctx=(user_id, category, record_id))
+    # add_result ждёт русское название категории
+    await state.update_data(result_ctx=(call.from_user.id, TABLE_CATEGORY[table], record["id"]))
     await state.set_state(Form.add_result)
     await call.message.answer("Введите текст итога:")
 
@@ -465,81 +614,41 @@ async def add_result_input(message: types.Message, state: FSMContext):
     await state.clear()
 
 
-# ================== Удаление (контекстная версия) ==================
-@dp.callback_query(lambda c: c.data and c.data.startswith("delete_ctx_"))
-async def delete_record_ctx_callback(call: types.CallbackQuery):
-    # формат: delete_ctx_{user_id}_{index}
-    parts = call.data.split("_")
-    if len(parts) != 4:
-        await call.answer("Неверные данные.")
+# ================== Удаление ==================
+@record_router.callback_query(RecCb.filter(F.action == "d"))
+async def delete_record_callback(call: types.CallbackQuery, callback_data: RecCb):
+    table, record = await owned_record(call, callback_data)
+    if record is None:
         return
-    _, _ctx, user_id_str, idx_str = parts
-    user_id = int(user_id_str)
-    index = int(idx_str)
-
-    if call.from_user.id != user_id:
-        await call.answer("Нельзя удалять чужие записи.", show_alert=True)
-        return
-
-    ctx = USER_CONTEXT.get(user_id, [])
-    if index < 0 or index >= len(ctx):
-        await call.answer("Элемент не найден.", show_alert=True)
-        return
-
-    entry = ctx[index]
-    table = entry["table"]
-    rec_id = entry["id"]
 
     # удаляем в БД
-    await delete_record(table, rec_id)
+    await delete_record(table, record["id"])
 
-    # удаляем из контекста
-    ctx.pop(index)
-    USER_CONTEXT[user_id] = ctx
+    # из сохранённых результатов поиска — тоже
+    if callback_data.page == SEARCH_PAGE:
+        ctx = await USER_CONTEXT.get(call.from_user.id)
+        for index, item in enumerate(ctx.items if ctx else []):
+            if (item.table, item.id) == (table, record["id"]):
+                await USER_CONTEXT.pop_item(call.from_user.id, index)
+                break
 
     await call.answer("Запись удалена ✅", show_alert=True)
-    # Обновляем список (контекст) — если есть элементы, показать их, иначе показать общий список
-    if ctx:
-        await show_records_menu(call)
-    else:
-        await show_records_menu(call)
+    # Обновляем список, из которого открыта запись
+    await show_list(call, callback_data.page)
 
 
-# ================== Перенос даты (контекстная версия) ==================
-@dp.callback_query(lambda c: c.data and c.data.startswith("manual_move_ctx_"))
-async def manual_move_ctx_callback(call: types.CallbackQuery, state: FSMContext):
-    # формат: manual_move_ctx_{user_id}_{index}
-    parts = call.data.split("_")
-    # manual, move, ctx, user_id, index → минимум 5 частей
-    if len(parts) < 5:
-        await call.answer("Неверные данные.")
-        return
-
-    user_id_str = parts[-2]
-    idx_str = parts[-1]
-
-    user_id = int(user_id_str)
-    index = int(idx_str)
-
-    if call.from_user.id != user_id:
-        await call.answer("Нельзя менять дату чужой записи.", show_alert=True)
+# ================== Перенос даты ==================
+@record_router.callback_query(RecCb.filter(F.action == "m"))
+async def manual_move_callback(call: types.CallbackQuery, callback_data: RecCb, state: FSMContext):
+    table, record = await owned_record(call, callback_data)
+    if record is None:
         return
 
-    ctx = USER_CONTEXT.get(user_id, [])
-    if index < 0 or index >= len(ctx):
-        await call.answer("Элемент не найден.", show_alert=True)
-        return
-
-    entry = ctx[index]
-    table = entry["table"]
-    rec_id = entry["id"]
-
-    await state.update_data(move_record_ctx=(user_id, index, table, rec_id))
+    await state.update_data(move_record=(table, record["id"]))
     await state.set_state(Form.move_datetime)
     await call.message.answer("Введите дату в формате ДД.MM.ГГГГ ЧЧ:ММ")
 
 
-
 # ================== Обработчик ввода даты ИЛИ ввода слова для поиска (используем одно состояние) ==================
 @dp.message(Form.move_datetime)
 async def manual_date_or_search_input(message: types.Message, state: FSMContext):
@@ -549,61 +658,26 @@ async def manual_date_or_search_input(message: types.Message, state: FSMContext)
     if data.get("search_global"):
         query = message.text.strip()
         user_id = message.from_user.id
-        aggregated: list[dict] = []
-        for category, table in CATEGORY_TABLE.items():
-            rows = await get_records(table, user_id)
-            for row in rows:
-                if any(isinstance(v, str) and query.lower() in v.lower() for v in row.values()):
-                    aggregated.append({
-                        "table": table,
-                        "id": row["id"],
-                        "title": row.get("title") or "",
-                        "created_at": row["created_at"],
-                        "raw": row,
-                        "category": category
-                    })
-        aggregated.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        USER_CONTEXT[user_id] = aggregated
-        await state.clear()
-
-        if not aggregated:
-            await message.answer("Ничего не найдено.")
-            return
-
-        # показать результаты поиска как набор ctx-кнопок
-        buttons: list[list[InlineKeyboardButton]] = []
-        for idx, item in enumerate(aggregated):
-            cat = item["category"]
-            title = item["title"]
-            date_str = item["created_at"].strftime("%d.%m.%Y")
-            buttons.append([InlineKeyboardButton(text=f"{cat} — {title} — {date_str}", callback_data=f"ctx_{user_id}_{idx}")])
-        buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="back")])
-        kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-        await message.answer(f"Найдено записей: {len(aggregated)}", reply_markup=kb)
-        return
-
-    # 2) перенос даты из контекста (move_record_ctx)
-    if "move_record_ctx" in data:
-        user_id, index, table, rec_id = data["move_record_ctx"]
-        if message.from_user.id != user_id:
-            await message.answer("Нельзя менять дату чужой записи.")
-            await state.clear()
-            return
+        ticket = LIST_LOADS.begin(user_id)
         try:
-            new_datetime = datetime.strptime(message.text.strip(), "%d.%m.%Y %H:%M")
-        except ValueError:
-            await message.answer("Неверный формат даты. Попробуйте снова (ДД.MM.ГГГГ ЧЧ:ММ).")
-            return
+            aggregated = await LIST_LOADS.do((user_id, "search", query), lambda: find_records(user_id, query))
+            await state.clear()
+            if not LIST_LOADS.is_latest(user_id, ticket):
+                return
+            # результаты поиска сохраняем: к ним ведёт «Назад к списку» из открытой записи
+            ctx = await USER_CONTEXT.set(user_id, aggregated)
 
-        await update_record_datetime(table, rec_id, new_datetime)
-        await message.answer("Дата записи обновлена ✅")
-        await state.clear()
+            if not ctx.items:
+                await message.answer("Ничего не найдено.")
+                return
 
-        # пересобрать контекст и показать список (пользователь сможет открыть запись)
-        await show_records_menu(message)
+            kb = build_list_kb(ctx.items, origin=SEARCH_PAGE, search=False)
+            await message.answer(f"Найдено записей: {len(ctx.items)}", reply_markup=kb)
+        finally:
+            LIST_LOADS.end(user_id, ticket)
         return
 
-    # 3) перенос даты в non-ctx режиме (если вдруг использовали другой путь) — ничего не ломаем:
+    # 2) перенос даты (владелец проверен при нажатии кнопки)
     if "move_record" in data:
         table, rec_id = data["move_record"]
         try:
@@ -622,47 +696,14 @@ async def manual_date_or_search_input(message: types.Message, state: FSMContext)
     await message.answer("Неизвестная операция — отменено.")
 
 
-# ================== Назад к списку (контекст) ==================
-@dp.callback_query(lambda c: c.data and c.data.startswith("back_to_list_ctx_"))
-async def back_to_list_ctx(call: types.CallbackQuery):
-    # формат: back_to_list_ctx_{user_id}
-    parts = call.data.split("_")
-    # back, to, list, ctx, user_id → минимум 5 частей
-    if len(parts) < 5:
-        await call.answer("Неверные данные.")
-        return
-
-    user_id_str = parts[-1]
-    user_id = int(user_id_str)
-
-    if call.from_user.id != user_id:
-        await call.answer("Это не ваш список.", show_alert=True)
-        return
-
-    ctx = USER_CONTEXT.get(user_id, [])
-    if not ctx:
-        await show_records_menu(call)
-        return
-
-    buttons: list[list[InlineKeyboardButton]] = []
-    for idx, item in enumerate(ctx):
-        cat = item["category"]
-        title = item["title"]
-        date_str = item["created_at"].strftime("%d.%m.%Y")
-        buttons.append([InlineKeyboardButton(
-            text=f"{cat} — {title} — {date_str}",
-            callback_data=f"ctx_{user_id}_{idx}"
-        )])
-    buttons.append([InlineKeyboardButton(text="🔍 Поиск", callback_data="search_all")])
-    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="back")])
-
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await call.message.edit_text("Выберите запись:", reply_markup=kb)
-
+# ================== Назад к списку ==================
+@list_router.callback_query(ListCb.filter())
+async def back_to_list(call: types.CallbackQuery, callback_data: ListCb):
+    await show_list(call, callback_data.page)
 
 
 # ================== Поиск: начало (глобальный) ==================
-@dp.callback_query(lambda c: c.data and c.data == "search_all")
+@list_router.callback_query(MenuCb.filter(F.action == "search"))
 async def search_all_callback(call: types.CallbackQuery, state: FSMContext):
     # переход в состояние ввода поискового слова
     await state.update_data(search_global=True)
@@ -671,7 +712,7 @@ async def search_all_callback(call: types.CallbackQuery, state: FSMContext):
 
 
 # ================== Главное меню ==================
-@dp.callback_query(lambda c: c.data == "back")
+@list_router.callback_query(MenuCb.filter(F.action == "home"))
 async def back_callback(call: types.CallbackQuery):
     await call.message.answer("Главное меню:", reply_markup=main_keyboard())
     # удаляем предыдущее сообщение с клавой
@@ -681,138 +722,44 @@ async def back_callback(call: types.CallbackQuery):
         pass
 
 
-# ================== Поддержка старого (table-style) просмотра ==================
-@dp.callback_query(lambda c: c.data and c.data.startswith("read_"))
-async def read_record_table_style(call: types.CallbackQuery):
-    # формат: read_{table}_{record_id}_{idx} (table может содержать _)
-    parts = call.data.split("_")[1:]
-    if len(parts) < 2:
-        await call.answer("Неверные данные.")
-        return
+dp.include_routers(list_router, record_router)
+# задержки и ошибки по обработчикам и запросам к БД (METRICS_PORT — отдать Prometheus)
+setup_metrics(dp, USER_CONTEXT)
+# не больше THROTTLE_RATE апдейтов в секунду на пользователя (с запасом THROTTLE_BURST), лишние — до FSM и БД
+setup_throttling(dp)
+# список доступа — для всех апдейтов, до FSM; обновляется без перезапуска (SIGHUP, NOTIFY, см. access.py)
+ACCESS = setup_access(dp)
+# медленные запросы — в лог, выборочно с EXPLAIN (см. slowlog.py)
+setup_slow_query_log()
 
-    # Попробуем распарсить: предположим что последние два элемента — id и idx
-    try:
-        record_id = int(parts[-2])
-        index = int(parts[-1])
-        table = "_".join(parts[:-2])
-    except Exception:
-        # fallback: если нет idx — id последний
-        try:
-            record_id = int(parts[-1])
-            index = 0
-            table = "_".join(parts[:-1])
-        except Exception:
-            await call.answer("Неверные данные.")
-            return
 
-    # получаем список записей таблицы
-    records = await get_records(table, call.from_user.id)
-    index = next((i for i, r in enumerate(records) if r["id"] == record_id), 0)
-    if index < 0 or index >= len(records):
-        await call.answer("Запись не найдена.")
-        return
+# ================== Старт и остановка ==================
+# Вызываются и при polling, и при webhook (см. webhook.setup_application)
+@dp.startup()
+async def on_startup():
+    await create_db_pool()
+    if MIGRATE_ON_STARTUP:
+        await migrate()
+    await ACCESS.start()
+    serve_metrics()
+    if WRITE_BATCHING:
+        await start_write_queue()
 
-    record = records[index]
-    text = format_record(record, table)
-
-    buttons = []
-    nav_row = []
-    if index > 0:
-        nav_row.append(InlineKeyboardButton(
-            text="◀️ Предыдущая",
-            callback_data=f"read_{table}_{records[index-1]['id']}_{index-1}"
-        ))
-    if index < len(records) - 1:
-        nav_row.append(InlineKeyboardButton(
-            text="Следующая ▶️",
-            callback_data=f"read_{table}_{records[index+1]['id']}_{index+1}"
-        ))
-    if nav_row:
-        buttons.append(nav_row)
-
-    buttons.append([
-        InlineKeyboardButton(text="❌ Удалить", callback_data=f"delete_{table}_{record_id}_{index}"),
-        InlineKeyboardButton(text="📆 Перенести дату", callback_data=f"manual_move_{table}_{record_id}_{index}")
-    ])
-    buttons.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data="back")])
-    # Итог
-    parts = call.data.split("_")
-    user_id = int(parts[2])
-    record_id = int(parts[3])
-    result_text = await get_result(table, record_id)
-    if result_text:
-        buttons.append([
-            InlineKeyboardButton(
-                text="📄 Просмотреть итог",
-                callback_data=f"shows_result_ctx_{user_id}_{index}"
-            ),
-            InlineKeyboardButton(
-                text="✏️ Перезаписать итог",
-                callback_data=f"result_add_ctx_{user_id}_{index}"
-            )
-        ])
-    else:
-        buttons.append([
-            InlineKeyboardButton(
-                text="➕ Добавить итог",
-                callback_data=f"result_add_ctx_{user_id}_{index}"
-            )
-        ])
-
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await call.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
-
-
-# ================== Удаление (table-style, non-ctx) ==================
-@dp.callback_query(lambda c: c.data and c.data.startswith("delete_"))
-async def delete_record_callback(call: types.CallbackQuery):
-    parts = call.data.split("_")[1:]
-    # reconstruct table
-    if len(parts) >= 3:
-        table = "_".join(parts[:-2])
-        record_id = int(parts[-2])
-        index = int(parts[-1])
-    elif len(parts) == 2:
-        table = parts[0]
-        record_id = int(parts[1])
-        index = 0
-    else:
-        await call.answer("Неверные данные.")
-        return
-
-    await delete_record(table, record_id)
-    await call.answer("Запись удалена ✅", show_alert=True)
-    # После удаления — показать агрегированный список (как при Прочитать)
-    await show_records_menu(call)
-
-
-# ================== Перенос даты (non-ctx) ==================
-@dp.callback_query(lambda c: c.data and c.data.startswith("manual_move_") and not c.data.startswith("manual_move_ctx_"))
-async def manual_move_callback(call: types.CallbackQuery, state: FSMContext):
-    # формат: manual_move_{table}_{record_id}_{index}
-    parts = call.data.split("_")[1:]
-    if len(parts) >= 3:
-        table = "_".join(parts[:-2])
-        record_id = int(parts[-2])
-    elif len(parts) == 2:
-        table = parts[0]
-        record_id = int(parts[1])
-    else:
-        await call.answer("Неверные данные.")
-        return
-
-    await state.update_data(move_record=(table, record_id))
-    await state.set_state(Form.move_datetime)
-    await call.message.answer("Введите дату в формате ДД.MM.ГГГГ ЧЧ:ММ")
 
+@dp.shutdown()
+async def on_shutdown():
+    await ACCESS.stop()
+    # дописываем очередь записи и закрываем пул
+    await close_db_pool()
 
 
 # ================== Запуск ==================
-if __name__ == "__main__":
-    async def main():
-        await create_db_pool()
-        await dp.start_polling(bot)
-
-    asyncio.run(main())
-
+# BOT_MODE=polling (по умолчанию) или webhook (см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
+if __name__ == "__main__":
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        run_webhook(dp, bot)
+    else:
+        asyncio.run(dp.start_polling(bot))
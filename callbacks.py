@@ -0,0 +1,71 @@
+from typing import Annotated
+
+from aiogram import F
+from aiogram.filters.callback_data import CallbackData
+from pydantic import Field
+
+from functions import MAX_ID, TABLE_CODE
+
+
+# ================== Callback-данные инлайн-кнопок ==================
+# Формат aiogram: {prefix}:{поле}:{поле}... — разбор один раз, в фильтре CallbackData.filter().
+# Кнопки записей несут таблицу и id, а не номер в списке: любой тап обслуживается
+# запросом по индексу, без списков в памяти процесса (переживает рестарт и несколько воркеров).
+# Telegram ограничивает callback_data 64 байтами — курсоры пишем в base36 (encode_cursor).
+
+# Откуда открыта запись (поле page): "" — первая страница списка, SEARCH_PAGE — результаты поиска,
+# иначе encode_cursor() верхней записи страницы
+SEARCH_PAGE = "s"
+
+# id записи из кнопки: вне int4 — не наша кнопка, фильтр её не пропустит
+RecordId = Annotated[int, Field(gt=0, le=MAX_ID)]
+
+
+class PageCb(CallbackData, prefix="pg"):
+    """Листание списка: cursor — encode_cursor() крайней записи страницы"""
+    backward: bool
+    cursor: str
+
+
+class RecCb(CallbackData, prefix="r"):
+    """Операция над записью cat:id"""
+    action: str  # v — просмотр, d — удалить, m — перенести дату, r — итог, a — записать итог
+    cat: str  # код таблицы, см. functions.TABLE_CODE
+    id: RecordId
+    page: str = ""
+
+
+class NavCb(CallbackData, prefix="n"):
+    """
+    Соседняя запись того списка, откуда открыта текущая (page): ленты — по cursor, результатов поиска
+    (page=SEARCH_PAGE) — по их порядку в USER_CONTEXT. backward — предыдущая; cursor — encode_cursor() открытой записи
+    """
+    backward: bool
+    cursor: str
+    page: str = ""
+
+
+class PartCb(CallbackData, prefix="pt"):
+    """Страница длинной карточки записи cat:id (см. renderer.split_pages)"""
+    cat: str
+    id: RecordId
+    part: Annotated[int, Field(ge=0, le=MAX_ID)]
+    page: str = ""
+
+
+class ListCb(CallbackData, prefix="list"):
+    """Назад к списку, из которого открыта запись"""
+    page: str = ""
+
+
+class MenuCb(CallbackData, prefix="menu"):
+    action: str  # search / home
+
+
+def record_cb(action, table, record_id, page=""):
+    return RecCb(action=action, cat=TABLE_CODE[table], id=record_id, page=page).pack()
+
+
+def prefix_filter(*factories):
+    """Фильтр роутера: callback_data начинается с префикса одной из фабрик"""
+    return F.data.startswith(tuple(f"{f.__prefix__}{f.__separator__}" for f in factories))
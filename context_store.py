@@ -0,0 +1,133 @@
+import os
+import time
+from collections import OrderedDict
+
+from functions import CATEGORY_TABLE
+
+# table → русское название категории ("spreads" → "Расклад")
+TABLE_CATEGORY = {table: category for category, table in CATEGORY_TABLE.items()}
+
+# Длиннее в кнопке всё равно не показать
+TITLE_MAX_LEN = 64
+
+
+class NavItem:
+    """Одна строка списка: только то, что нужно для кнопки и перехода к записи"""
+    __slots__ = ("table", "id", "title", "created_at")
+
+    def __init__(self, table, record_id, title, created_at):
+        self.table = table
+        self.id = record_id
+        self.title = (title or "")[:TITLE_MAX_LEN]
+        self.created_at = created_at
+
+    @property
+    def category(self):
+        return TABLE_CATEGORY.get(self.table, self.table)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row["table"], row["id"], row.get("title"), row["created_at"])
+
+
+class UserContext:
+    """Показанный пользователю список и курсоры его страниц"""
+    __slots__ = ("items", "page", "expires_at")
+
+    def __init__(self, items, page, expires_at):
+        self.items = items
+        self.page = page
+        self.expires_at = expires_at
+
+
+class ContextStore:
+    """
+    Навигационные контексты пользователей: LRU + TTL.
+    max_users — сколько пользователей держим одновременно,
+    max_items — общий лимит строк на процесс (грубая оценка памяти).
+    """
+
+    def __init__(self, max_users=1000, max_items=50_000, ttl=3600, clock=time.monotonic):
+        self.max_users = max_users
+        self.max_items = max_items
+        self.ttl = ttl
+        self._clock = clock
+        self._data: OrderedDict[int, UserContext] = OrderedDict()
+        self._items_total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, user_id) -> UserContext | None:
+        ctx = self._data.get(user_id)
+        if ctx is None:
+            self.misses += 1
+            return None
+        if ctx.expires_at <= self._clock():
+            self._drop(user_id)
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return ctx
+
+    def set(self, user_id, rows, page=None) -> UserContext:
+        """rows — строки из БД (dict с table, id, title, created_at) или готовые NavItem"""
+        items = [row if isinstance(row, NavItem) else NavItem.from_row(row) for row in rows]
+        if user_id in self._data:
+            self._drop(user_id)
+        ctx = UserContext(items, page, self._clock() + self.ttl)
+        self._data[user_id] = ctx
+        self._items_total += len(items)
+        self._evict()
+        return ctx
+
+    def pop_item(self, user_id, index):
+        ctx = self._data.get(user_id)
+        if ctx is None or not 0 <= index < len(ctx.items):
+            return None
+        self._items_total -= 1
+        return ctx.items.pop(index)
+
+    def discard(self, user_id):
+        if user_id in self._data:
+            self._drop(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._data),
+            "items": self._items_total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _drop(self, user_id):
+        ctx = self._data.pop(user_id)
+        self._items_total -= len(ctx.items)
+
+    def _evict(self):
+        # Протухшие с холодного конца LRU (остальные отсеет get), затем самые давно использованные
+        now = self._clock()
+        while self._data:
+            user_id, ctx = next(iter(self._data.items()))
+            if ctx.expires_at > now:
+                break
+            self._drop(user_id)
+            self.evictions += 1
+        # последний (только что записанный) контекст не выселяем, даже если он один больше лимита
+        while len(self._data) > 1 and (len(self._data) > self.max_users or self._items_total > self.max_items):
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+
+
+def context_store_from_env() -> ContextStore:
+    return ContextStore(
+        max_users=int(os.getenv("CONTEXT_MAX_USERS", "1000")),
+        max_items=int(os.getenv("CONTEXT_MAX_ITEMS", "50000")),
+        ttl=int(os.getenv("CONTEXT_TTL", "3600")),
+    )
@@ -1,4 +1,7 @@
 import os
+import time
+import asyncio
+from collections import OrderedDict
 import asyncpg
 from dotenv import load_dotenv
 from datetime import datetime
@@ -15,6 +18,121 @@ DB_PORT = int(os.getenv("DB_PORT"))
 # Глобальный пул
 db_pool: asyncpg.Pool | None = None
 
+# ================== Схема категорий ==================
+# Текстовые поля каждой категории (порядок = порядок ввода в FSM); из них собирается search_tsv
+TEXT_COLUMNS = {
+    "spreads": ("title", "question", "cards", "interpretation"),
+    "dreams": ("title", "dream_text", "interpretation"),
+    "premonitions": ("title", "premonition_text", "interpretation"),
+    "rituals": ("title", "purpose", "tools", "action", "feelings"),
+}
+# Что отдаём наружу вместо SELECT * (служебный search_tsv не тянем)
+RECORD_COLUMNS = {
+    table: ("id", "user_id", "created_at", "has_result") + columns
+    for table, columns in TEXT_COLUMNS.items()
+}
+RESULT_COLUMNS = ("id", "user_id", "category", "reference_id", "result_text", "created_at")
+KNOWN_TABLES = frozenset(CATEGORY_TABLE.values())
+
+# ================== Реестр запросов ==================
+# Все запросы собираются один раз при импорте; имена таблиц берутся только из CATEGORY_TABLE.
+# Готовит их asyncpg: у каждого соединения свой кэш подготовленных запросов (statement_cache_size),
+# так что повторный запрос с тем же текстом идёт без PREPARE.
+STATEMENTS: dict[tuple[str, str | None], str] = {}
+
+
+class UnknownTableError(ValueError):
+    """Таблица не из CATEGORY_TABLE (например, пришла из подделанного callback_data)"""
+
+
+def register(name, query=None, per_table=None):
+    """Общий запрос — query; запрос для каждой категории — per_table(table) -> sql"""
+    if per_table is not None:
+        for table in KNOWN_TABLES:
+            STATEMENTS[(name, table)] = per_table(table)
+    else:
+        STATEMENTS[(name, None)] = query
+    return query
+
+
+def sql(name, table=None):
+    if table is not None and table not in KNOWN_TABLES:
+        raise UnknownTableError(table)
+    return STATEMENTS[(name, table)]
+
+
+_STATEMENT_NAMES: dict[str, str] = {}
+
+
+def statement_name(query):
+    """Имя запроса для метрик и логов: name или name:table из реестра, иначе other"""
+    name = _STATEMENT_NAMES.get(query)
+    if name is None:
+        name = next((f"{key}:{table}" if table else key
+                     for (key, table), registered in STATEMENTS.items() if registered == query), "other")
+        _STATEMENT_NAMES[query] = name
+    return name
+
+
+def _columns(table, alias=None):
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + col for col in RECORD_COLUMNS[table])
+
+# ================== Кэш записей и итогов ==================
+class LRUCache:
+    """Кэш с вытеснением давно не использованных ключей и счётчиками попаданий"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# Кэш живёт в процессе: при нескольких воркерах (общий STORAGE_BACKEND=redis/postgres) чужие изменения
+# он не увидит. Поэтому по умолчанию выключен; включать (например, 1024) — только для одного процесса.
+RECORD_CACHE_SIZE = int(os.getenv("RECORD_CACHE_SIZE", "0"))
+# (table, id) → запись
+record_cache = LRUCache(RECORD_CACHE_SIZE)
+# (category, reference_id) → последний итог или None (итога нет — тоже ответ)
+result_cache = LRUCache(RECORD_CACHE_SIZE)
+_MISSING = object()
+
+
+def invalidate_record(table, record_id):
+    record_cache.invalidate((table, record_id))
+    result_cache.invalidate((table, record_id))
+
+
+def cache_stats():
+    return {"records": record_cache.stats(), "results": result_cache.stats()}
+
 # ================== Создание пула ==================
 async def create_db_pool():
     global db_pool
@@ -27,154 +145,481 @@ async def create_db_pool():
             port=DB_PORT,
             min_size=1,
             max_size=20,
-            max_inactive_connection_lifetime=300
+            max_inactive_connection_lifetime=300,
+            server_settings={"pg_trgm.word_similarity_threshold": str(SEARCH_SIMILARITY)},
+            # весь реестр STATEMENTS помещается в кэш, с запасом под разовые запросы
+            statement_cache_size=max(100, 2 * len(STATEMENTS)),
         )
 
+# ================== Закрытие пула ==================
+async def close_db_pool():
+    """Сначала дописываем очередь записи, затем закрываем соединения"""
+    global db_pool
+    await stop_write_queue()
+    if db_pool is not None:
+        pool, db_pool = db_pool, None
+        await pool.close()
+
+# ================== Наблюдатели запросов ==================
+# Подписчики (см. metrics.py) вызываются после каждого запроса через _run:
+#   QUERY_OBSERVERS:   fn(query, method, args, result, seconds, error) — seconds без ожидания соединения
+#   ACQUIRE_OBSERVERS: fn(seconds) — сколько ждали свободное соединение пула
+QUERY_OBSERVERS: list = []
+ACQUIRE_OBSERVERS: list = []
+
 # ================== Универсальные функции ==================
-async def execute(query, *args):
+async def _run(method, query, args):
+    started = time.perf_counter()
     async with db_pool.acquire() as conn:
+        acquired = time.perf_counter()
+        for observer in ACQUIRE_OBSERVERS:
+            observer(acquired - started)
+        result = error = None
         try:
-            return await conn.execute(query, *args)
-        except (asyncpg.exceptions.ConnectionDoesNotExistError,
-                asyncpg.exceptions.PostgresConnectionError):
-            async with db_pool.acquire() as conn_retry:
-                return await conn_retry.execute(query, *args)
+            try:
+                result = await getattr(conn, method)(query, *args)
+            except (asyncpg.exceptions.ConnectionDoesNotExistError,
+                    asyncpg.exceptions.PostgresConnectionError):
+                async with db_pool.acquire() as conn_retry:
+                    result = await getattr(conn_retry, method)(query, *args)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if QUERY_OBSERVERS:
+                seconds = time.perf_counter() - acquired
+                for observer in QUERY_OBSERVERS:
+                    observer(query, method, args, result, seconds, error)
+
+async def execute(query, *args):
+    return await _run("execute", query, args)
 
 async def fetch(query, *args):
-    async with db_pool.acquire() as conn:
-        try:
-            return await conn.fetch(query, *args)
-        except (asyncpg.exceptions.ConnectionDoesNotExistError,
-                asyncpg.exceptions.PostgresConnectionError):
-            async with db_pool.acquire() as conn_retry:
-                return await conn_retry.fetch(query, *args)
+    return await _run("fetch", query, args)
 
 async def fetchrow(query, *args):
-    async with db_pool.acquire() as conn:
-        try:
-            row = await conn.fetchrow(query, *args)
-        except (asyncpg.exceptions.ConnectionDoesNotExistError,
-                asyncpg.exceptions.PostgresConnectionError):
-            async with db_pool.acquire() as conn_retry:
-                row = await conn_retry.fetchrow(query, *args)
-        return dict(row) if row else None
+    row = await _run("fetchrow", query, args)
+    return dict(row) if row else None
 
 # ================== Добавление записей ==================
-async def add_record(table, user_id, **kwargs):
+register("add_record", per_table=lambda table: (
+    f"INSERT INTO {table}(user_id, created_at, {', '.join(TEXT_COLUMNS[table])}) "
+    f"VALUES({', '.join(f'${i}' for i in range(1, len(TEXT_COLUMNS[table]) + 3))})"
+))
+INSERT_RESULT_QUERY = register("insert_result",
+    "INSERT INTO results(user_id, category, reference_id, result_text, created_at) VALUES($1,$2,$3,$4,$5)"
+)
+
+
+async def add_record(table, user_id, wait=True, **kwargs):
+    """
+    Вставка записи. При включённой пакетной записи (WRITE_BATCHING=1) строка уходит в очередь;
+    wait=True дожидается, пока пакет будет записан в БД, иначе возвращается Future.
+    """
     now = datetime.now()
-    if table == "spreads":
-        await execute(
-            "INSERT INTO spreads(user_id, created_at, title, question, cards, interpretation) "
-            "VALUES($1,$2,$3,$4,$5,$6)",
-            user_id, now, kwargs.get("title"), kwargs.get("question"),
-            kwargs.get("cards"), kwargs.get("interpretation")
-        )
-    elif table == "dreams":
-        await execute(
-            "INSERT INTO dreams(user_id, created_at, title, dream_text, interpretation) "
-            "VALUES($1,$2,$3,$4,$5)",
-            user_id, now, kwargs.get("title"), kwargs.get("dream_text"),
-            kwargs.get("interpretation")
-        )
-    elif table == "premonitions":
-        await execute(
-            "INSERT INTO premonitions(user_id, created_at, title, premonition_text, interpretation) "
-            "VALUES($1,$2,$3,$4,$5)",
-            user_id, now, kwargs.get("title"), kwargs.get("premonition_text"),
-            kwargs.get("interpretation")
-        )
-    elif table == "rituals":
-        await execute(
-            "INSERT INTO rituals(user_id, created_at, title, purpose, tools, action, feelings) "
-            "VALUES($1,$2,$3,$4,$5,$6,$7)",
-            user_id, now, kwargs.get("title"), kwargs.get("purpose"),
-            kwargs.get("tools"), kwargs.get("action"), kwargs.get("feelings")
-        )
-    elif table == "results":
-        await execute(
-            "INSERT INTO results(user_id, category, reference_id, result_text, created_at) "
-            "VALUES($1,$2,$3,$4,$5)",
-            user_id, kwargs.get("category"), kwargs.get("reference_id"),
-            kwargs.get("result_text"), now
-        )
+    if table == "results":
+        query = INSERT_RESULT_QUERY
+        args = (user_id, kwargs.get("category"), kwargs.get("reference_id"), kwargs.get("result_text"), now)
+    else:
+        query = sql("add_record", table)
+        args = (user_id, now, *(kwargs.get(col) for col in TEXT_COLUMNS[table]))
+
+    if write_queue is None:
+        await execute(query, *args)
+        return None
+    done = await write_queue.submit(query, args)
+    if wait:
+        await done
+    return done
+
+# ================== Пакетная запись (write-behind) ==================
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "0") == "1"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.05"))  # секунды
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "1000"))
+
+
+class WriteBehindQueue:
+    """
+    Копит INSERT'ы и пишет их пачками через executemany: пачка уходит, когда набралось
+    batch_size строк или прошло delay секунд с первой строки. Очередь ограничена maxsize —
+    при переполнении submit ждёт (память не растёт). Каждой строке соответствует Future,
+    который завершается после записи её пачки (или с исключением, если строка не записалась).
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, delay=WRITE_BATCH_DELAY, maxsize=WRITE_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.delay = delay
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.rows = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker())
+
+    async def submit(self, query, args) -> asyncio.Future:
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, args, done))
+        return done
+
+    async def close(self):
+        """Дописать всё, что осталось в очереди, и остановить воркер"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        by_query: dict[str, list] = {}
+        for query, args, done in batch:
+            by_query.setdefault(query, []).append((args, done))
+
+        for query, items in by_query.items():
+            try:
+                await _run("executemany", query, ([args for args, _ in items],))
+            except Exception:
+                # пачка откатилась целиком — пишем по одной, чтобы ошибку получила только плохая строка
+                for args, done in items:
+                    try:
+                        await execute(query, *args)
+                    except Exception as e:
+                        if not done.done():
+                            done.set_exception(e)
+                    else:
+                        if not done.done():
+                            done.set_result(None)
+            else:
+                for _, done in items:
+                    if not done.done():
+                        done.set_result(None)
+            self.batches += 1
+            self.rows += len(items)
+
+
+write_queue: WriteBehindQueue | None = None
+
+
+async def start_write_queue():
+    global write_queue
+    if write_queue is None:
+        write_queue = WriteBehindQueue()
+        write_queue.start()
+
+
+async def stop_write_queue():
+    global write_queue
+    if write_queue is not None:
+        queue, write_queue = write_queue, None
+        await queue.close()
 
 # ================== Получение всех записей пользователя ==================
+register("get_records", per_table=lambda table: (
+    f"SELECT {_columns(table)} FROM {table} WHERE user_id=$1 ORDER BY created_at DESC"
+))
+
+
 async def get_records(table, user_id):
-    rows = await fetch(f"SELECT * FROM {table} WHERE user_id=$1 ORDER BY created_at DESC", user_id)
+    rows = await fetch(sql("get_records", table), user_id)
     return [dict(row) for row in rows]
 
+# ================== Лента записей по всем категориям ==================
+# Узкая таблица entries (user_id, created_at, category, ref_id, title, has_result) — сводный индекс
+# всех категорий, её ведут триггеры (см. migrations.py). Страница ленты — один
+# диапазон индекса (user_id, created_at, ref_id, category) вместо UNION ALL по четырём таблицам.
+_ENTRY_CATEGORY = "CASE category " + " ".join(
+    f"WHEN '{table}' THEN '{category}'" for category, table in CATEGORY_TABLE.items()
+) + " END"
+_ENTRY_COLUMNS = f'category AS "table", ref_id AS id, title, created_at, {_ENTRY_CATEGORY} AS category'
+
+# ================== Постраничная лента (keyset по created_at, id, таблица) ==================
+# ref_id у каждой категории свой serial: spreads#5 и dreams#5 с одной датой различает только category
+PAGE_SIZE = 10
+
+
+def _timeline_page_query(condition, order):
+    return (f"SELECT {_ENTRY_COLUMNS} FROM entries WHERE user_id=$1{condition} "
+            f"ORDER BY created_at {order}, ref_id {order}, category {order} LIMIT $2")
+
+
+TIMELINE_FIRST_PAGE_QUERY = register("timeline_first", _timeline_page_query("", "DESC"))
+TIMELINE_OLDER_PAGE_QUERY = register("timeline_older", _timeline_page_query(
+    " AND (created_at, ref_id, category) < ($3, $4, $5)", "DESC"))
+TIMELINE_NEWER_PAGE_QUERY = register("timeline_newer", _timeline_page_query(
+    " AND (created_at, ref_id, category) > ($3, $4, $5)", "ASC"))
+TIMELINE_FROM_PAGE_QUERY = register("timeline_from", _timeline_page_query(
+    " AND (created_at, ref_id, category) <= ($3, $4, $5)", "DESC"))
+
+
+async def get_timeline_page(user_id, cursor=None, backward=False, limit=PAGE_SIZE, inclusive=False):
+    """
+    Одна страница ленты, от новых к старым.
+    cursor — (created_at, id, table) граничной записи: при backward=False берём записи старше неё,
+    при backward=True — новее; inclusive=True — страница начинается с самой этой записи.
+    Возвращает (items, has_more), где has_more говорит, есть ли ещё записи дальше в направлении выборки.
+    """
+    if cursor is None:
+        rows = await fetch(TIMELINE_FIRST_PAGE_QUERY, user_id, limit + 1)
+    elif inclusive:
+        rows = await fetch(TIMELINE_FROM_PAGE_QUERY, user_id, limit + 1, *cursor)
+    elif backward:
+        rows = await fetch(TIMELINE_NEWER_PAGE_QUERY, user_id, limit + 1, *cursor)
+    else:
+        rows = await fetch(TIMELINE_OLDER_PAGE_QUERY, user_id, limit + 1, *cursor)
+
+    items = [dict(row) for row in rows[:limit]]
+    if backward:
+        items.reverse()
+    return items, len(rows) > limit
+
 # ================== Получение записи по ID ==================
+register("get_record", per_table=lambda table: f"SELECT {_columns(table)} FROM {table} WHERE id=$1")
+
+
 async def get_record_by_id(table, record_id):
-    return await fetchrow(f"SELECT * FROM {table} WHERE id=$1", record_id)
-
-# ================== Поиск по слову ==================
-async def search_records(table, user_id, keyword):
-    keyword = f"%{keyword.lower()}%"
-    query = f"""
-        SELECT * FROM {table}
-        WHERE user_id=$1 AND LOWER(title || ' ' || COALESCE(question,'') || ' ' || 
-                                  COALESCE(cards,'') || ' ' || COALESCE(interpretation,'') ||
-                                  COALESCE(dream_text,'') || COALESCE(premonition_text,'') ||
-                                  COALESCE(purpose,'') || COALESCE(tools,'') || COALESCE(action,'') || COALESCE(feelings,'')) 
-              LIKE $2
-        ORDER BY created_at DESC
+    record = record_cache.get((table, record_id), _MISSING)
+    if record is _MISSING:
+        record = await fetchrow(sql("get_record", table), record_id)
+        if record is not None and RECORD_CACHE_SIZE:
+            record_cache.put((table, record_id), record)
+    return dict(record) if record else None
+
+# ================== Запись вместе с последним итогом ==================
+# Итог подтягивается LATERAL-подзапросом в том же запросе; его колонки идут с префиксом res__
+_RESULT_PREFIX = "res__"
+register("get_record_with_result", per_table=lambda table: (
+    f"SELECT {_columns(table, 'r')}, "
+    f"{', '.join(f'res.{col} AS {_RESULT_PREFIX}{col}' for col in RESULT_COLUMNS)} FROM {table} r "
+    f"LEFT JOIN LATERAL ("
+    f"SELECT {', '.join(RESULT_COLUMNS)} FROM results "
+    f"WHERE category=$2 AND reference_id=r.id ORDER BY created_at DESC LIMIT 1"
+    f") res ON TRUE WHERE r.id=$1"
+))
+
+
+async def get_record_with_result(table, record_id):
+    """(запись, последний итог или None) за один запрос; (None, None) если записи нет"""
+    record = record_cache.get((table, record_id), _MISSING)
+    result = result_cache.get((table, record_id), _MISSING)
+    if record is not _MISSING and result is not _MISSING:
+        return dict(record), (dict(result) if result else None)
+
+    row = await fetchrow(sql("get_record_with_result", table), record_id, table)
+    if row is None:
+        return None, None
+
+    record = {k: v for k, v in row.items() if not k.startswith(_RESULT_PREFIX)}
+    result = None
+    if row[f"{_RESULT_PREFIX}id"] is not None:
+        result = {col: row[f"{_RESULT_PREFIX}{col}"] for col in RESULT_COLUMNS}
+    if RECORD_CACHE_SIZE:
+        record_cache.put((table, record_id), record)
+        result_cache.put((table, record_id), result)
+    return dict(record), (dict(result) if result else None)
+
+# ================== Полнотекстовый поиск ==================
+SEARCH_CONFIG = "russian"
+SEARCH_LIMIT = 50
+# Порог word_similarity для нечёткого поиска (pg_trgm), 0..1
+SEARCH_SIMILARITY = float(os.getenv("SEARCH_SIMILARITY", "0.4"))
+
+
+def _search_tsv_expression(table):
+    # Заголовок весит больше остального текста (вес A против B) — влияет на ts_rank
+    body = " || ' ' || ".join(f"coalesce({col}, '')" for col in TEXT_COLUMNS[table][1:])
+    return (f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', {body}), 'B')")
+
+
+SEARCH_TIMELINE_QUERY = register("search_timeline", " UNION ALL ".join(
+    f"SELECT '{table}' AS \"table\", id, COALESCE(title, '') AS title, created_at, '{category}' AS category, "
+    f"ts_rank(search_tsv, q) AS rank "
+    f"FROM {table}, websearch_to_tsquery('{SEARCH_CONFIG}', $2) q WHERE user_id=$1 AND search_tsv @@ q"
+    for category, table in CATEGORY_TABLE.items()
+) + " ORDER BY rank DESC, created_at DESC LIMIT $3")
+
+
+async def search_timeline(user_id, query, limit=SEARCH_LIMIT):
+    """Поиск по всем категориям одним запросом, лучшие совпадения первыми"""
+    rows = await fetch(SEARCH_TIMELINE_QUERY, user_id, query, limit)
+    return [dict(row) for row in rows]
+
+
+def _fuzzy_branch(category, table):
+    columns = TEXT_COLUMNS[table]
+    # $2 — слово, $3 — шаблон для ILIKE; <% использует pg_trgm.word_similarity_threshold
+    rank = ", ".join(f"word_similarity($2, {col})" for col in columns)
+    match = " OR ".join(f"{col} ILIKE $3 OR $2 <% {col}" for col in columns)
+    return (f"SELECT '{table}' AS \"table\", id, COALESCE(title, '') AS title, created_at, '{category}' AS category, "
+            f"GREATEST({rank}) AS rank "
+            f"FROM {table} WHERE user_id=$1 AND ({match})")
+
+
+SEARCH_FUZZY_QUERY = register("search_fuzzy", " UNION ALL ".join(
+    _fuzzy_branch(category, table) for category, table in CATEGORY_TABLE.items()
+) + " ORDER BY rank DESC, created_at DESC LIMIT $4")
+
+
+def _like_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+async def search_timeline_fuzzy(user_id, query, limit=SEARCH_LIMIT, threshold: float | None = None):
+    """
+    Нечёткий поиск по всем категориям (pg_trgm): подстрока или похожее слово
+    ("Дурак" найдёт "Дурачок"). threshold переопределяет SEARCH_SIMILARITY для этого запроса.
     """
-    rows = await fetch(query, user_id, keyword)
+    args = (user_id, query, _like_pattern(query), limit)
+    if threshold is None:
+        rows = await fetch(SEARCH_FUZZY_QUERY, *args)
+    else:
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT set_config('pg_trgm.word_similarity_threshold', $1, true)", str(threshold))
+                rows = await conn.fetch(SEARCH_FUZZY_QUERY, *args)
+    return [dict(row) for row in rows]
+
+
+register("search_records", per_table=lambda table: (
+    f"SELECT {_columns(table)} FROM {table}, websearch_to_tsquery('{SEARCH_CONFIG}', $2) q "
+    f"WHERE user_id=$1 AND search_tsv @@ q "
+    f"ORDER BY ts_rank(search_tsv, q) DESC, created_at DESC LIMIT $3"
+))
+
+
+async def search_records(table, user_id, keyword, limit=SEARCH_LIMIT):
+    """Поиск полных записей в одной таблице"""
+    rows = await fetch(sql("search_records", table), user_id, keyword, limit)
     return [dict(row) for row in rows]
 
 # ================== Обновление даты записи ==================
+register("update_datetime", per_table=lambda table: f"UPDATE {table} SET created_at=$1 WHERE id=$2")
+
+
 async def update_record_datetime(table, record_id, new_datetime: datetime):
-    await execute(f"UPDATE {table} SET created_at=$1 WHERE id=$2", new_datetime, record_id)
+    await execute(sql("update_datetime", table), new_datetime, record_id)
+    record_cache.invalidate((table, record_id))
 
 # ================== Удаление записи ==================
+register("delete_record", per_table=lambda table: f"DELETE FROM {table} WHERE id=$1")
+
+
 async def delete_record(table, record_id):
-    await execute(f"DELETE FROM {table} WHERE id=$1", record_id)
+    await execute(sql("delete_record", table), record_id)
+    invalidate_record(table, record_id)
 
 # ================== Результаты
+GET_RESULT_QUERY = register("get_result",
+    f"SELECT {', '.join(RESULT_COLUMNS)} FROM results "
+    f"WHERE category=$1 AND reference_id=$2 ORDER BY created_at DESC LIMIT 1"
+)
+
+
 async def get_result(category, reference_id):
-    row = await fetchrow(
-        "SELECT * FROM results WHERE category=$1 AND reference_id=$2 ORDER BY created_at DESC LIMIT 1",
-        category, reference_id
-    )
-    return row
+    row = result_cache.get((category, reference_id), _MISSING)
+    if row is _MISSING:
+        row = await fetchrow(GET_RESULT_QUERY, category, reference_id)
+        if RECORD_CACHE_SIZE:
+            result_cache.put((category, reference_id), row)
+    return dict(row) if row else None
+
+# ================== Итог + флаг has_result одним запросом ==================
+# Data-modifying CTE: вставка в results и UPDATE флага атомарны и идут одним round trip
+register("add_result", per_table=lambda table: (
+    f"WITH ins AS ("
+    f"INSERT INTO results(user_id, category, reference_id, result_text, created_at) "
+    f"VALUES($1, '{table}', $2, $3, $4) RETURNING reference_id"
+    f") UPDATE {table} SET has_result=TRUE WHERE id IN (SELECT reference_id FROM ins)"
+))
+# То же для пачки: строки приходят массивами и разворачиваются unnest — один запрос на таблицу
+register("add_results", per_table=lambda table: (
+    f"WITH ins AS ("
+    f"INSERT INTO results(user_id, category, reference_id, result_text, created_at) "
+    f"SELECT user_id, '{table}', reference_id, result_text, created_at "
+    f"FROM unnest($1::bigint[], $2::int[], $3::text[], $4::timestamp[]) "
+    f"AS v(user_id, reference_id, result_text, created_at) RETURNING reference_id"
+    f") UPDATE {table} SET has_result=TRUE WHERE id IN (SELECT reference_id FROM ins)"
+))
+
 
-# ================== Обновление флага
 async def add_result(user_id, category, reference_id, result_text):
     now = datetime.now()
     # переводим категорию в английское имя для БД
     category_db = CATEGORY_TABLE[category]  # 'Предчувствие' → 'premonitions', и т.д.
 
-    await execute(
-        "INSERT INTO results(user_id, category, reference_id, result_text, created_at) "
-        "VALUES($1,$2,$3,$4,$5)",
-        user_id, category_db, reference_id, result_text, now
-    )
+    await execute(sql("add_result", category_db), user_id, reference_id, result_text, now)
+    # новый итог и флаг has_result — обе закэшированные версии устарели
+    invalidate_record(category_db, reference_id)
 
-    # Обновляем флаг в основной таблице
-    await execute(f"UPDATE {category_db} SET has_result=TRUE WHERE id=$1", reference_id)
 
-# ================== Получение конкретного итога для записи
-async def get_our_result(user_id: int, record_id: int, category_name: str = None):
+async def add_results(rows, conn=None):
+    """
+    Пакетная запись итогов (импорт истории): rows — (user_id, category, reference_id, result_text, created_at),
+    category — русское название или имя таблицы. Весь пакет в одной транзакции, по запросу на таблицу;
+    conn — уже взятое соединение (importer), иначе берётся из пула.
+    """
+    by_table: dict[str, list[tuple]] = {}
+    for user_id, category, reference_id, result_text, created_at in rows:
+        table = CATEGORY_TABLE.get(category, category)
+        if table not in KNOWN_TABLES:
+            raise UnknownTableError(table)
+        by_table.setdefault(table, []).append((user_id, reference_id, result_text, created_at or datetime.now()))
 
-    if category_name:
-        category_db = CATEGORY_TABLE.get(category_name, category_name)
-        query = """
-            SELECT * FROM results
-            WHERE user_id=$1 AND category=$2 AND reference_id=$3
-            ORDER BY created_at DESC
-            LIMIT 1
-        """
-        row = await fetchrow(query, user_id, category_db, record_id)
+    if conn is None:
+        async with db_pool.acquire() as conn:
+            await _add_results(conn, by_table)
     else:
-        query = """
-            SELECT * FROM results
-            WHERE user_id=$1 AND reference_id=$2
-            ORDER BY created_at DESC
-            LIMIT 1
-        """
-        row = await fetchrow(query, user_id, record_id)
+        await _add_results(conn, by_table)
+
+    for table, args in by_table.items():
+        for _user_id, reference_id, _text, _created_at in args:
+            invalidate_record(table, reference_id)
+
 
+async def _add_results(conn, by_table):
+    async with conn.transaction():
+        for table, args in by_table.items():
+            await conn.execute(sql("add_results", table), *(list(column) for column in zip(*args)))
 
-    return row
+# ================== Получение конкретного итога для записи
+OUR_RESULT_BY_CATEGORY_QUERY = register("our_result_by_category",
+    f"SELECT {', '.join(RESULT_COLUMNS)} FROM results "
+    f"WHERE user_id=$1 AND category=$2 AND reference_id=$3 ORDER BY created_at DESC LIMIT 1"
+)
+OUR_RESULT_QUERY = register("our_result",
+    f"SELECT {', '.join(RESULT_COLUMNS)} FROM results "
+    f"WHERE user_id=$1 AND reference_id=$2 ORDER BY created_at DESC LIMIT 1"
+)
 
 
+async def get_our_result(user_id: int, record_id: int, category_name: str = None):
+    if category_name:
+        category_db = CATEGORY_TABLE.get(category_name, category_name)
+        return await fetchrow(OUR_RESULT_BY_CATEGORY_QUERY, user_id, category_db, record_id)
+    return await fetchrow(OUR_RESULT_QUERY, user_id, record_id)
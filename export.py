@@ -0,0 +1,141 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import db
+from functions import CATEGORY_TABLE
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("jsonl", "csv")
+# Сколько строк курсор забирает с сервера за раз и сколько строк пишем в файл одним куском
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", "500"))
+
+# Колонки CSV: служебное поле table + объединение колонок всех таблиц
+CSV_FIELDS = ["table"] + list(dict.fromkeys(
+    col for columns in list(db.RECORD_COLUMNS.values()) + [db.RESULT_COLUMNS] for col in columns
+))
+
+db.register("export", per_table=lambda table: (
+    f"SELECT {', '.join(db.RECORD_COLUMNS[table])} FROM {table} "
+    f"WHERE user_id=$1 AND created_at >= $2 AND created_at < $3 ORDER BY created_at, id"
+))
+EXPORT_RESULTS_QUERY = db.register("export_results", (
+    f"SELECT {', '.join(db.RESULT_COLUMNS)} FROM results "
+    f"WHERE user_id=$1 AND category = ANY($2::text[]) AND created_at >= $3 AND created_at < $4 "
+    f"ORDER BY created_at, id"
+))
+
+
+class ExportStats:
+    __slots__ = ("path", "rows", "seconds")
+
+    def __init__(self, path, rows, seconds):
+        self.path = path
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+# ================== Разбор аргументов /export ==================
+def parse_export_args(text):
+    """
+    /export [jsonl|csv] [Категория] [ДД.ММ.ГГГГ-ДД.ММ.ГГГГ] — любые части можно опустить.
+    Возвращает (fmt, tables, date_from, date_to); date_to — не включительно. ValueError с текстом для пользователя.
+    """
+    fmt = "jsonl"
+    tables = list(CATEGORY_TABLE.values())
+    date_from, date_to = datetime.min, datetime.max
+    categories = {name.lower(): table for name, table in CATEGORY_TABLE.items()}
+    categories.update({table: table for table in CATEGORY_TABLE.values()})
+
+    for arg in text.split()[1:]:
+        low = arg.lower()
+        if low in EXPORT_FORMATS:
+            fmt = low
+        elif low in categories:
+            tables = [categories[low]]
+        elif "-" in arg:
+            start, _, end = arg.partition("-")
+            try:
+                date_from = datetime.strptime(start, "%d.%m.%Y")
+                date_to = datetime.strptime(end, "%d.%m.%Y") + timedelta(days=1)
+            except (ValueError, OverflowError):
+                # OverflowError — конец периода 31.12.9999: следующего дня у datetime нет
+                raise ValueError("Период в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ") from None
+        else:
+            raise ValueError(f"Не понял «{arg}». Пример: /export csv Сон 01.01.2024-31.12.2024")
+    return fmt, tables, date_from, date_to
+
+
+# ================== Поток строк из БД ==================
+async def iter_export_rows(user_id, tables, date_from=datetime.min, date_to=datetime.max,
+                           prefetch=EXPORT_PREFETCH):
+    """
+    (table, row) по всем выбранным таблицам и их итогам. Серверный курсор внутри транзакции:
+    в памяти одновременно не больше prefetch строк.
+    """
+    async with db.db_pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            for table in tables:
+                async for row in conn.cursor(db.sql("export", table), user_id, date_from, date_to,
+                                             prefetch=prefetch):
+                    yield table, row
+            async for row in conn.cursor(EXPORT_RESULTS_QUERY, user_id, list(tables), date_from, date_to,
+                                         prefetch=prefetch):
+                yield "results", row
+
+
+def _jsonl_line(table, row):
+    return json.dumps({"table": table, **dict(row)}, ensure_ascii=False, default=str) + "\n"
+
+
+async def export_diary(user_id, fmt="jsonl", tables=None, date_from=datetime.min, date_to=datetime.max,
+                       prefetch=EXPORT_PREFETCH) -> ExportStats:
+    """Пишет дневник в сжатый временный файл (удалить — забота вызывающего; при ошибке удаляется здесь)"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(fmt)
+    tables = tables or list(CATEGORY_TABLE.values())
+
+    fd, path = tempfile.mkstemp(prefix=f"diary_{user_id}_", suffix=f".{fmt}.gz")
+    os.close(fd)
+    started = time.perf_counter()
+    try:
+        rows = 0
+        chunk = io.StringIO()
+        writer = csv.DictWriter(chunk, fieldnames=CSV_FIELDS, restval="", extrasaction="ignore")
+        if fmt == "csv":
+            writer.writeheader()
+
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as out:
+            async for table, row in iter_export_rows(user_id, tables, date_from, date_to, prefetch):
+                if fmt == "jsonl":
+                    chunk.write(_jsonl_line(table, row))
+                else:
+                    writer.writerow({"table": table, **dict(row)})
+                rows += 1
+                if rows % prefetch == 0:
+                    # сжатие и запись на диск — вне event loop
+                    await asyncio.to_thread(out.write, chunk.getvalue())
+                    chunk.seek(0)
+                    chunk.truncate()
+            await asyncio.to_thread(out.write, chunk.getvalue())
+    except BaseException:
+        # ошибка БД, кодирования, отмена — файл вызывающему не достанется, удаляем сами
+        os.unlink(path)
+        raise
+
+    stats = ExportStats(path, rows, time.perf_counter() - started)
+    logger.info("export user=%s fmt=%s rows=%s %.2fs (%.0f rows/s)",
+                user_id, fmt, rows, stats.seconds, stats.rows_per_second)
+    return stats
@@ -1,4 +1,4 @@
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from datetime import datetime, timedelta
 
 CATEGORY_TABLE = {
     "Расклад": "spreads",
@@ -7,6 +7,52 @@ CATEGORY_TABLE = {
     "Ритуал": "rituals"
 }
 
+# Однобуквенные коды таблиц для callback_data (лимит Telegram — 64 байта)
+TABLE_CODE = {"spreads": "s", "dreams": "d", "premonitions": "p", "rituals": "r"}
+CODE_TABLE = {code: table for table, code in TABLE_CODE.items()}
+
+_EPOCH = datetime(1970, 1, 1)
+# id записей — serial (int4) в Postgres; больше в запрос не передать (asyncpg DataError)
+MAX_ID = 2**31 - 1
+
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _base36(n):
+    # даты до 1970 года дают отрицательные микросекунды: divmod(-1, 36) == (-1, 35) — ноль не наступит
+    if n < 0:
+        return "-" + _base36(-n)
+    out = ""
+    while True:
+        n, rem = divmod(n, 36)
+        out = _DIGITS[rem] + out
+        if not n:
+            return out
+
+
+def encode_cursor(created_at, record_id, table):
+    """
+    Курсор (created_at, id, table) для callback_data: {микросекунды}_{id}_{код таблицы}, числа в base36, ~20 символов.
+    id у каждой таблицы свой (serial) — без таблицы две записи с одной датой неразличимы.
+    """
+    micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{_base36(micros)}_{_base36(record_id)}_{TABLE_CODE[table]}"
+
+
+def decode_cursor(value):
+    """Обратное к encode_cursor: (created_at, id, table). ValueError при мусоре."""
+    micros, record_id, code = value.split("_")
+    record_id = int(record_id, 36)
+    if not 0 < record_id <= MAX_ID or code not in CODE_TABLE:
+        raise ValueError(value)
+    try:
+        return _EPOCH + timedelta(microseconds=int(micros, 36)), record_id, CODE_TABLE[code]
+    except OverflowError:
+        # слишком большое число из подделанной кнопки — тот же мусор
+        raise ValueError(value) from None
+
+
 def main_keyboard():
     from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
     kb = ReplyKeyboardMarkup(
@@ -26,66 +72,3 @@ def category_keyboard(back=True):
     if back:
         rows.append([KeyboardButton(text="Назад")])
     return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
-
-def build_record_kb(table, records, index):
-    """Клавиатура для просмотра одной записи"""
-    buttons = []
-
-    # Навигация
-    nav_row = []
-    if index > 0:
-        nav_row.append(InlineKeyboardButton("◀️ Предыдущая", callback_data=f"read_{table}_{records[index-1]['id']}"))
-    if index < len(records) - 1:
-        nav_row.append(InlineKeyboardButton("Следующая ▶️", callback_data=f"read_{table}_{records[index+1]['id']}"))
-    if nav_row:
-        buttons.append(nav_row)
-
-    # Действия с записью
-    buttons.append([
-        InlineKeyboardButton("❌ Удалить", callback_data=f"delete_{table}_{records[index]['id']}"),
-        InlineKeyboardButton("📆 Перенести дату", callback_data=f"move_{table}_{records[index]['id']}")
-    ])
-
-    # Главное меню
-    buttons.append([InlineKeyboardButton("🏠 Главное меню", callback_data="back")])
-
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-
-def build_search_results_kb(records):
-    """Клавиатура для результатов поиска"""
-    buttons = []
-    for rec in records:
-        buttons.append([InlineKeyboardButton(
-            text=f"{rec.get('title','Без названия')} — {rec['created_at'].strftime('%d.%m.%Y')}",
-            callback_data=f"read_{rec['table']}_{rec['id']}"
-        )])
-    buttons.append([InlineKeyboardButton("🏠 Главное меню", callback_data="back")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-
-def format_record(record, category, result=None):
-    text = f"📌 <b>{record.get('title','Без названия')}</b>\n"
-    text += f"🗓 Дата: {record['created_at'].strftime('%d.%m.%Y %H:%M')}\n"
-
-    if category == "spreads":
-        text += f"❓ Вопрос: {record.get('question')}\n"
-        text += f"🃏 Карты: {record.get('cards')}\n"
-        text += f"📝 Трактовка: {record.get('interpretation')}\n"
-    elif category == "dreams":
-        text += f"💤 Сон: {record.get('dream_text')}\n"
-        text += f"📝 Трактовка: {record.get('interpretation')}\n"
-    elif category == "premonitions":
-        text += f"🔮 Предчувствие: {record.get('premonition_text')}\n"
-        text += f"📝 Трактовка: {record.get('interpretation')}\n"
-    elif category == "rituals":
-        text += f"🎯 Цель: {record.get('purpose')}\n"
-        text += f"🛠 Инструменты: {record.get('tools')}\n"
-        text += f"⚡ Действия: {record.get('action')}\n"
-        text += f"💫 Ощущения: {record.get('feelings')}\n"
-
-    if result:
-        text += f"\n🎯 Итог: {result.get('result_text')}"
-
-    return text
-
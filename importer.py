@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+
+import db
+from functions import CATEGORY_TABLE
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк одной таблицы уходит в один COPY (и одну транзакцию)
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+# Сколько причин отказа показываем пользователю
+MAX_ERRORS_SHOWN = 10
+
+DATE_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+# Новые id выдаём заранее из последовательности таблицы: так итоги из того же файла
+# можно перевязать со старых id на новые без лишних запросов
+db.register("next_ids", per_table=lambda table: (
+    f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id FROM generate_series(1, $1)"
+))
+db.register("own_ids", per_table=lambda table: (
+    f"SELECT id FROM {table} WHERE user_id=$1 AND id = ANY($2::bigint[])"
+))
+
+
+class ImportFileError(Exception):
+    """Файл не читается дальше (кодировка, битый .gz, CSV) — причина для пользователя в тексте"""
+
+    def __init__(self, reason, report):
+        super().__init__(reason)
+        self.report = report
+
+
+# что может бросить чтение файла посреди импорта
+_FILE_ERRORS = (UnicodeDecodeError, gzip.BadGzipFile, EOFError, zlib.error, csv.Error)
+
+
+def _file_error_reason(error):
+    if isinstance(error, UnicodeDecodeError):
+        return "файл не в кодировке UTF-8"
+    if isinstance(error, csv.Error):
+        return f"ошибка CSV: {error}"
+    return "архив .gz повреждён"
+
+
+class ImportReport:
+    __slots__ = ("rows", "imported", "rejected", "errors", "seconds")
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors: list[str] = []
+        self.seconds = 0.0
+
+    def reject(self, line_no, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS_SHOWN:
+            self.errors.append(f"строка {line_no}: {reason}")
+
+
+# ================== Чтение файла ==================
+def open_rows(path):
+    """Строки файла как dict: CSV или JSONL, можно в .gz. Читается потоково."""
+    name = path.lower()
+    opener = gzip.open if name.endswith(".gz") else open
+    name = name[:-3] if name.endswith(".gz") else name
+    with opener(path, "rt", encoding="utf-8-sig", newline="") as f:
+        if name.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None  # validate_row отклонит строку, файл читаем дальше
+
+
+def _take(rows, n):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= n:
+            break
+    return chunk
+
+
+# ================== Проверка строк ==================
+_CATEGORIES = {name.lower(): table for name, table in CATEGORY_TABLE.items()}
+_CATEGORIES.update({table: table for table in CATEGORY_TABLE.values()})
+
+
+def _str(value):
+    """Поле как строка: в JSONL числа и прочее приходят как есть"""
+    return "" if value is None else str(value).strip()
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    value = _str(value)
+    if not value:
+        return datetime.now()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"непонятная дата «{value}»")
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int_or_none(value):
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except TypeError:
+        raise ValueError(value) from None
+
+
+def validate_row(raw):
+    """
+    Строка файла → (table, значения). Таблица — поле table (как в /export) или category
+    с русским названием. ValueError с причиной, если строку брать нельзя.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("ожидался объект")
+    table = _str(raw.get("table")).lower()
+    if table != "results":
+        table = _CATEGORIES.get(table or _str(raw.get("category")).lower())
+        if table is None:
+            raise ValueError("неизвестная категория")
+
+    created_at = _parse_datetime(raw.get("created_at"))
+
+    if table == "results":
+        category = _CATEGORIES.get(_str(raw.get("category")).lower())
+        if category is None:
+            raise ValueError("у итога неизвестная категория")
+        try:
+            reference_id = int(raw.get("reference_id"))
+        except (TypeError, ValueError):
+            raise ValueError("у итога нет reference_id")
+        result_text = _text(raw.get("result_text"))
+        if not result_text:
+            raise ValueError("пустой итог")
+        return table, {"category": category, "reference_id": reference_id,
+                       "result_text": result_text, "created_at": created_at}
+
+    values = {col: _text(raw.get(col)) for col in db.TEXT_COLUMNS[table]}
+    if not values["title"]:
+        raise ValueError("нет названия")
+    try:
+        values["old_id"] = _int_or_none(raw.get("id"))
+    except ValueError:
+        raise ValueError("id не число")
+    values["created_at"] = created_at
+    return table, values
+
+
+# ================== Загрузка ==================
+async def _copy_records(conn, table, user_id, rows, id_map):
+    columns = ("id", "user_id", "created_at", "has_result") + db.TEXT_COLUMNS[table]
+    new_ids = [r["id"] for r in await conn.fetch(db.sql("next_ids", table), len(rows))]
+    records = []
+    for new_id, values in zip(new_ids, rows):
+        if values["old_id"] is not None:
+            id_map[(table, values["old_id"])] = new_id
+        records.append((new_id, user_id, values["created_at"], False,
+                        *(values[col] for col in db.TEXT_COLUMNS[table])))
+    async with conn.transaction():
+        await conn.copy_records_to_table(table, records=records, columns=columns)
+
+
+async def _copy_results(conn, user_id, results, id_map, report):
+    # ссылки на записи не из файла должны указывать на записи этого же пользователя
+    unresolved: dict[str, set[int]] = {}
+    for _line_no, values in results:
+        if (values["category"], values["reference_id"]) not in id_map:
+            unresolved.setdefault(values["category"], set()).add(values["reference_id"])
+    existing = set()
+    for table, ids in unresolved.items():
+        rows = await conn.fetch(db.sql("own_ids", table), user_id, list(ids))
+        existing.update((table, r["id"]) for r in rows)
+
+    records = []
+    for line_no, values in results:
+        key = (values["category"], values["reference_id"])
+        reference_id = id_map.get(key) or (values["reference_id"] if key in existing else None)
+        if reference_id is None:
+            report.reject(line_no, "итог ссылается на несуществующую запись")
+            continue
+        records.append((user_id, values["category"], reference_id, values["result_text"], values["created_at"]))
+
+    # итоги и флаг has_result их записей — одним запросом на таблицу (db.add_results), порция — одна транзакция
+    for start in range(0, len(records), IMPORT_CHUNK_SIZE):
+        chunk = records[start:start + IMPORT_CHUNK_SIZE]
+        await db.add_results(chunk, conn)
+        report.imported += len(chunk)
+
+
+async def import_file(path, user_id, chunk_size=IMPORT_CHUNK_SIZE, progress=None) -> ImportReport:
+    """
+    Загружает записи (через COPY) и итоги (db.add_results) из CSV/JSONL в таблицы пользователя user_id,
+    порциями по chunk_size строк — каждая порция в своей транзакции.
+    progress(report) вызывается после каждой порции (может быть корутиной).
+    Итоги откладываются до конца файла: к тому времени известны новые id их записей.
+    Если файл перестал читаться, ImportFileError; уже загруженные порции остаются.
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+    rows = open_rows(path)
+
+    try:
+        async with db.db_pool.acquire() as conn:
+            await _load(conn, rows, user_id, chunk_size, progress, report, started)
+    except _FILE_ERRORS as e:
+        logger.warning("import user=%s stopped after %s rows: %r", user_id, report.rows, e)
+        raise ImportFileError(_file_error_reason(e), report) from e
+    finally:
+        rows.close()
+
+    report.seconds = time.perf_counter() - started
+    logger.info("import user=%s rows=%s imported=%s rejected=%s %.2fs",
+                user_id, report.rows, report.imported, report.rejected, report.seconds)
+    return report
+
+
+async def _load(conn, rows, user_id, chunk_size, progress, report, started):
+    results: list[tuple[int, dict]] = []
+    id_map: dict[tuple[str, int], int] = {}
+    while True:
+        # чтение и разбор файла — вне event loop
+        chunk = await asyncio.to_thread(_take, rows, chunk_size)
+        if not chunk:
+            break
+        by_table: dict[str, list[dict]] = {}
+        for raw in chunk:
+            report.rows += 1
+            try:
+                table, values = validate_row(raw)
+            except ValueError as e:
+                report.reject(report.rows, e)
+                continue
+            if table == "results":
+                results.append((report.rows, values))
+            else:
+                by_table.setdefault(table, []).append(values)
+
+        for table, table_rows in by_table.items():
+            await _copy_records(conn, table, user_id, table_rows, id_map)
+            report.imported += len(table_rows)
+
+        report.seconds = time.perf_counter() - started
+        if progress is not None:
+            res = progress(report)
+            if asyncio.iscoroutine(res):
+                await res
+
+    if results:
+        await _copy_results(conn, user_id, results, id_map, report)
+
+
+# ================== CLI ==================
+# python importer.py diary.csv --user-id 123456789
+async def _main(args):
+    def show(report):
+        print(f"\rстрок: {report.rows}, загружено: {report.imported}, отклонено: {report.rejected}",
+              end="", file=sys.stderr, flush=True)
+
+    await db.create_db_pool()
+    try:
+        report = await import_file(args.path, args.user_id, args.chunk_size, progress=show)
+    except ImportFileError as e:
+        print(f"\nФайл не прочитан: {e}; загружено до ошибки: {e.report.imported}", file=sys.stderr)
+        return 1
+    finally:
+        await db.close_db_pool()
+    print(file=sys.stderr)
+    for error in report.errors:
+        print(error, file=sys.stderr)
+    print(f"Готово за {report.seconds:.1f} с: загружено {report.imported}, отклонено {report.rejected}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт записей дневника из CSV/JSONL")
+    parser.add_argument("path", help="файл .csv / .jsonl (можно .gz)")
+    parser.add_argument("--user-id", type=int, required=True, help="Telegram id владельца записей")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    sys.exit(asyncio.run(_main(parser.parse_args())))
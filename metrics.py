@@ -0,0 +1,144 @@
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Порт для Prometheus (GET /metrics); 0 — метрики не отдаём. Слушаем только локально.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Запросы к БД в основном короче миллисекунды — корзины мельче стандартных
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# ================== Метрики ==================
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Полная обработка апдейта (фильтры, middleware, обработчик)",
+                           ["update_type"])
+UPDATE_ERRORS = Counter("bot_update_errors_total", "Апдейты, завершившиеся исключением", ["update_type"])
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработчика", ["handler", "update_type"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["handler", "update_type"])
+
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Выполнение запроса (без ожидания соединения)",
+                             ["statement", "method"], buckets=DB_BUCKETS)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "Запросы, завершившиеся ошибкой", ["statement", "method"])
+DB_ACQUIRE_SECONDS = Histogram("db_pool_acquire_seconds", "Ожидание свободного соединения пула",
+                               buckets=DB_BUCKETS)
+DB_POOL_SIZE = Gauge("db_pool_size", "Открытых соединений в пуле")
+DB_POOL_IN_USE = Gauge("db_pool_in_use", "Соединений, занятых запросами")
+DB_POOL_SIZE.set_function(lambda: db.db_pool.get_size() if db.db_pool else 0)
+DB_POOL_IN_USE.set_function(lambda: db.db_pool.get_size() - db.db_pool.get_idle_size() if db.db_pool else 0)
+DB_RECORD_CACHE = Gauge("db_record_cache", "Кэш записей и итогов (RECORD_CACHE_SIZE): size, hits, misses, "
+                        "evictions — счётчики с запуска процесса", ["cache", "stat"])
+for _cache, _stats in db.cache_stats().items():
+    for _stat in _stats:
+        DB_RECORD_CACHE.labels(_cache, _stat).set_function(lambda c=_cache, s=_stat: db.cache_stats()[c][s])
+NAV_CONTEXT = Gauge("bot_nav_context", "Контексты навигации USER_CONTEXT (storage.py): users, items, hits, misses, "
+                    "evictions — сколько есть у бэкенда; счётчики с запуска процесса", ["stat"])
+
+THROTTLED = Counter("bot_throttled_total", "Апдейты, отброшенные ограничителем частоты (throttling.py)",
+                    ["update_type"])
+THROTTLE_USERS = Gauge("bot_throttle_users", "Пользователей с активным ведром токенов")
+ACCESS_DENIED = Counter("bot_access_denied_total", "Апдейты от пользователей не из списка доступа (access.py)",
+                        ["update_type"])
+ALLOWED_USERS = Gauge("bot_allowed_users", "Пользователей в списке доступа")
+SINGLEFLIGHT_SHARED = Counter("bot_singleflight_shared_total",
+                              "Загрузки, дождавшиеся уже идущей такой же (singleflight.py)", ["name"])
+SINGLEFLIGHT_SUPERSEDED = Counter("bot_singleflight_superseded_total",
+                                  "Загрузки, результат которых не показан: пользователь уже запросил новее", ["name"])
+
+
+# ================== Middleware ==================
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на dp.update, первый в цепочке (до ошибок, FSM, троттлинга и доступа):
+    полное время апдейта по типу (message, callback_query, ...), включая отброшенные и хранилище FSM
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        update_type = getattr(event, "event_type", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.labels(update_type).inc()
+            raise
+        finally:
+            UPDATE_SECONDS.labels(update_type).observe(time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: вызывается уже для выбранного обработчика, его имя — в data["handler"]"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        update = data.get("event_update")
+        update_type = update.event_type if update is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name, update_type).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name, update_type).observe(time.perf_counter() - started)
+
+
+# ================== Запросы к БД ==================
+def _observe_query(query, method, args, result, seconds, error):
+    statement = db.statement_name(query)
+    DB_QUERY_SECONDS.labels(statement, method).observe(seconds)
+    if error is not None:
+        DB_QUERY_ERRORS.labels(statement, method).inc()
+
+
+def _observe_acquire(seconds):
+    DB_ACQUIRE_SECONDS.observe(seconds)
+
+
+# ================== Подключение ==================
+def setup_metrics(dp: Dispatcher, context=None):
+    """
+    Вешает middleware на dp (внутренние наследуются всеми вложенными роутерами) и наблюдателей на запросы db.py;
+    context — USER_CONTEXT (бэкенд из storage.py), его stats() отдаются как bot_nav_context
+    """
+    # у менеджера middleware нет insert: снимаем все внешние и вешаем обратно за нашим
+    manager = dp.update.outer_middleware
+    registered = list(manager)
+    for middleware in registered:
+        manager.unregister(middleware)
+    manager(UpdateMetricsMiddleware())
+    for middleware in registered:
+        manager(middleware)
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerMetricsMiddleware())
+
+    if context is not None:
+        for stat in context.stats():
+            NAV_CONTEXT.labels(stat).set_function(lambda s=stat: context.stats()[s])
+
+    if _observe_query not in db.QUERY_OBSERVERS:
+        db.QUERY_OBSERVERS.append(_observe_query)
+        db.ACQUIRE_OBSERVERS.append(_observe_acquire)
+
+
+_server_started = False
+
+
+def serve_metrics(port=METRICS_PORT, host=METRICS_HOST):
+    """HTTP-сервер с /metrics в отдельном потоке (один на процесс); port=0 — ничего не делает"""
+    global _server_started
+    if port and not _server_started:
+        start_http_server(port, addr=host)
+        _server_started = True
+        logger.info("metrics on http://%s:%s/metrics", host, port)
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Прогонять миграции при старте бота (MIGRATE_ON_STARTUP=0 — только вручную: python migrations.py up)
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+# Ключ pg_advisory_lock: несколько воркеров не накатывают миграции одновременно
+LOCK_KEY = 815_001
+
+
+# ================== Миграции ==================
+# (версия, название, список DDL). Уже применённые версии не меняем — только добавляем новые.
+# Всё через IF NOT EXISTS: базы, созданные до миграций вручную, принимаются как есть.
+def _tables():
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {table} ("
+        f"id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, created_at TIMESTAMP NOT NULL DEFAULT now(), "
+        f"has_result BOOLEAN NOT NULL DEFAULT FALSE, {', '.join(f'{col} TEXT' for col in columns)})"
+        for table, columns in db.TEXT_COLUMNS.items()
+    ]
+    # has_result появился позже самих таблиц
+    statements += [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS has_result BOOLEAN NOT NULL DEFAULT FALSE"
+        for table in db.TEXT_COLUMNS
+    ]
+    statements.append(
+        "CREATE TABLE IF NOT EXISTS results ("
+        "id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, category TEXT NOT NULL, reference_id INTEGER NOT NULL, "
+        "result_text TEXT NOT NULL, created_at TIMESTAMP NOT NULL DEFAULT now())"
+    )
+    return statements
+
+
+def _hot_indexes():
+    # Лента и страницы: WHERE user_id=$1 ORDER BY created_at DESC, id DESC (keyset) — и экспорт в обратную сторону
+    statements = [
+        f"CREATE INDEX IF NOT EXISTS {table}_user_created_idx ON {table} (user_id, created_at DESC, id DESC)"
+        for table in db.TEXT_COLUMNS
+    ]
+    # Последний итог записи: get_result и LATERAL в get_record_with_result / get_our_result
+    statements += [
+        "CREATE INDEX IF NOT EXISTS results_category_ref_idx ON results (category, reference_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS results_user_ref_idx ON results (user_id, reference_id, created_at DESC)",
+    ]
+    return statements
+
+
+def _search():
+    # Сгенерированные колонки search_tsv и GIN-индексы по ним (полнотекстовый поиск)
+    statements = []
+    for table in db.TEXT_COLUMNS:
+        statements += [
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+            f"GENERATED ALWAYS AS ({db._search_tsv_expression(table)}) STORED",
+            f"CREATE INDEX IF NOT EXISTS {table}_search_tsv_idx ON {table} USING GIN (search_tsv)",
+        ]
+    # Триграммы: опечатки и подстроки (ILIKE '%…%' идёт по индексу, а не seq scan)
+    statements.append("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, columns in db.TEXT_COLUMNS.items():
+        statements += [
+            f"CREATE INDEX IF NOT EXISTS {table}_{col}_trgm_idx ON {table} USING GIN ({col} gin_trgm_ops)"
+            for col in columns
+        ]
+    return statements
+
+
+def _storage():
+    # FSM и контекст для STORAGE_BACKEND=postgres (см. storage.py); при других бэкендах просто пустуют
+    return [
+        "CREATE TABLE IF NOT EXISTS fsm_storage ("
+        "key TEXT PRIMARY KEY, state TEXT, data JSONB NOT NULL DEFAULT '{}'::jsonb)",
+        "CREATE TABLE IF NOT EXISTS nav_context ("
+        "user_id BIGINT PRIMARY KEY, payload JSONB NOT NULL, expires_at TIMESTAMPTZ NOT NULL)",
+    ]
+
+
+def _backfill_entries():
+    """Пересобрать entries по таблицам категорий: дописать/обновить строки и убрать осиротевшие"""
+    statements = []
+    for table in db.TEXT_COLUMNS:
+        statements += [
+            f"INSERT INTO entries(user_id, created_at, category, ref_id, title, has_result) "
+            f"SELECT user_id, created_at, '{table}', id, COALESCE(title, ''), has_result FROM {table} "
+            f"ON CONFLICT (category, ref_id) DO UPDATE SET user_id=EXCLUDED.user_id, "
+            f"created_at=EXCLUDED.created_at, title=EXCLUDED.title, has_result=EXCLUDED.has_result",
+            f"DELETE FROM entries e WHERE e.category='{table}' "
+            f"AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id=e.ref_id)",
+        ]
+    return statements
+
+
+def _entries():
+    # Сводная лента всех категорий (см. db.TIMELINE_FIRST_PAGE_QUERY); category — имя таблицы, как в results
+    statements = [
+        "CREATE TABLE IF NOT EXISTS entries ("
+        "user_id BIGINT NOT NULL, created_at TIMESTAMP NOT NULL, category TEXT NOT NULL, ref_id INTEGER NOT NULL, "
+        "title TEXT NOT NULL DEFAULT '', has_result BOOLEAN NOT NULL DEFAULT FALSE, "
+        "PRIMARY KEY (category, ref_id))",
+        # INCLUDE — страница читается только из индекса (index-only scan)
+        "CREATE INDEX IF NOT EXISTS entries_user_created_idx ON entries (user_id, created_at DESC, ref_id DESC) "
+        "INCLUDE (category, title)",
+        # Запись категории → строка entries (таблица берётся из TG_TABLE_NAME)
+        "CREATE OR REPLACE FUNCTION entries_sync() RETURNS trigger AS $$ "
+        "BEGIN "
+        "IF TG_OP = 'DELETE' THEN "
+        "DELETE FROM entries WHERE category = TG_TABLE_NAME AND ref_id = OLD.id; "
+        "RETURN OLD; "
+        "END IF; "
+        "INSERT INTO entries(user_id, created_at, category, ref_id, title, has_result) "
+        "VALUES (NEW.user_id, NEW.created_at, TG_TABLE_NAME, NEW.id, COALESCE(NEW.title, ''), NEW.has_result) "
+        "ON CONFLICT (category, ref_id) DO UPDATE SET user_id=EXCLUDED.user_id, created_at=EXCLUDED.created_at, "
+        "title=EXCLUDED.title, has_result=EXCLUDED.has_result; "
+        "RETURN NEW; "
+        "END $$ LANGUAGE plpgsql",
+        # Итог → флаг has_result в entries; у самой записи флаг ставит db.add_result(s) тем же запросом
+        "CREATE OR REPLACE FUNCTION entries_result_sync() RETURNS trigger AS $$ "
+        "BEGIN "
+        "IF TG_OP = 'DELETE' THEN "
+        "UPDATE entries SET has_result = EXISTS ("
+        "SELECT 1 FROM results WHERE category = OLD.category AND reference_id = OLD.reference_id) "
+        "WHERE category = OLD.category AND ref_id = OLD.reference_id; "
+        "RETURN OLD; "
+        "END IF; "
+        "UPDATE entries SET has_result = TRUE "
+        "WHERE category = NEW.category AND ref_id = NEW.reference_id AND NOT has_result; "
+        "RETURN NEW; "
+        "END $$ LANGUAGE plpgsql",
+    ]
+    for table in db.TEXT_COLUMNS:
+        statements += [
+            f"DROP TRIGGER IF EXISTS {table}_entries ON {table}",
+            f"CREATE TRIGGER {table}_entries AFTER INSERT OR DELETE OR UPDATE OF user_id, created_at, title, "
+            f"has_result ON {table} FOR EACH ROW EXECUTE FUNCTION entries_sync()",
+        ]
+    statements += [
+        "DROP TRIGGER IF EXISTS results_entries ON results",
+        "CREATE TRIGGER results_entries AFTER INSERT OR DELETE ON results "
+        "FOR EACH ROW EXECUTE FUNCTION entries_result_sync()",
+    ]
+    # уже существующие записи
+    return statements + _backfill_entries()
+
+
+def _entries_keyset():
+    # Ключ ленты — (created_at, ref_id, category): ref_id у каждой категории свой serial, и без category
+    # две записи с одной датой и одинаковым id неразличимы — одна из них терялась на границе страниц
+    return [
+        "CREATE INDEX IF NOT EXISTS entries_user_keyset_idx "
+        "ON entries (user_id, created_at DESC, ref_id DESC, category DESC) INCLUDE (title)",
+        "DROP INDEX IF EXISTS entries_user_created_idx",
+    ]
+
+
+def _access():
+    # Список доступа (см. access.py): любое изменение — NOTIFY, и бот перечитывает список без перезапуска
+    return [
+        "CREATE TABLE IF NOT EXISTS allowed_users ("
+        "user_id BIGINT PRIMARY KEY, note TEXT, added_at TIMESTAMPTZ NOT NULL DEFAULT now())",
+        "CREATE OR REPLACE FUNCTION allowed_users_notify() RETURNS trigger AS $$ "
+        "BEGIN "
+        "PERFORM pg_notify('allowed_users', TG_OP); "
+        "RETURN NULL; "
+        "END $$ LANGUAGE plpgsql",
+        "DROP TRIGGER IF EXISTS allowed_users_notify ON allowed_users",
+        "CREATE TRIGGER allowed_users_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON allowed_users "
+        "FOR EACH STATEMENT EXECUTE FUNCTION allowed_users_notify()",
+    ]
+
+
+MIGRATIONS = [
+    (1, "tables", _tables()),
+    (2, "hot_indexes", _hot_indexes()),
+    (3, "search", _search()),
+    (4, "storage", _storage()),
+    (5, "entries", _entries()),
+    (6, "access", _access()),
+    (7, "entries_keyset", _entries_keyset()),
+]
+
+
+# ================== Применение ==================
+async def applied_versions(conn) -> dict[int, datetime]:
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    )
+    rows = await conn.fetch("SELECT version, applied_at FROM schema_migrations")
+    return {r["version"]: r["applied_at"] for r in rows}
+
+
+async def migrate() -> list[int]:
+    """
+    Накатывает недостающие миграции, каждую в своей транзакции. Возвращает применённые версии.
+    Если что-то применилось — соединения пула пересоздаются: кэш подготовленных запросов asyncpg
+    сбрасывается вместе с ними (типы столбцов в нём — от старой схемы).
+    """
+    applied = []
+    async with db.db_pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+        try:
+            done = await applied_versions(conn)
+            for version, name, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                async with conn.transaction():
+                    for statement in statements:
+                        await conn.execute(statement)
+                    await conn.execute("INSERT INTO schema_migrations(version, name) VALUES($1, $2)", version, name)
+                logger.info("migration %s_%s applied", version, name)
+                applied.append(version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+
+    if applied:
+        await db.db_pool.expire_connections()
+    return applied
+
+
+async def backfill_entries() -> int:
+    """Сверить entries с таблицами категорий (после ручных правок, COPY с отключёнными триггерами и т.п.)"""
+    async with db.db_pool.acquire() as conn:
+        async with conn.transaction():
+            for statement in _backfill_entries():
+                await conn.execute(statement)
+            return await conn.fetchval("SELECT count(*) FROM entries")
+
+
+# ================== Проверка планов горячих запросов ==================
+def _hot_queries():
+    """(название, запрос, аргументы) — параметры любые, важен только план"""
+    now = datetime.now()
+    queries = [
+        ("timeline_first", db.TIMELINE_FIRST_PAGE_QUERY, (0, db.PAGE_SIZE + 1)),
+        ("timeline_older", db.TIMELINE_OLDER_PAGE_QUERY, (0, db.PAGE_SIZE + 1, now, 0, "spreads")),
+        ("timeline_newer", db.TIMELINE_NEWER_PAGE_QUERY, (0, db.PAGE_SIZE + 1, now, 0, "spreads")),
+        ("timeline_from", db.TIMELINE_FROM_PAGE_QUERY, (0, db.PAGE_SIZE + 1, now, 0, "spreads")),
+        ("get_result", db.GET_RESULT_QUERY, ("spreads", 0)),
+        ("our_result_by_category", db.OUR_RESULT_BY_CATEGORY_QUERY, (0, "spreads", 0)),
+        ("our_result", db.OUR_RESULT_QUERY, (0, 0)),
+    ]
+    for table in db.TEXT_COLUMNS:
+        queries += [
+            (f"get_records[{table}]", db.sql("get_records", table), (0,)),
+            (f"get_record_with_result[{table}]", db.sql("get_record_with_result", table), (0, table)),
+        ]
+    return queries
+
+
+def _scans(plan):
+    """(тип узла, таблица, индекс) для всех узлов чтения таблиц в плане EXPLAIN (FORMAT JSON)"""
+    if "Relation Name" in plan:
+        yield plan["Node Type"], plan["Relation Name"], plan.get("Index Name")
+    for child in plan.get("Plans", ()):
+        yield from _scans(child)
+
+
+async def check_plans(conn) -> list[tuple[str, bool, list]]:
+    """
+    EXPLAIN каждого горячего запроса с enable_seqscan=off: если Seq Scan всё равно остался,
+    подходящего индекса нет. На пустой базе планировщик честно выбрал бы seq scan,
+    поэтому проверяем именно возможность индексного доступа.
+    """
+    report = []
+    for name, query, args in _hot_queries():
+        async with conn.transaction():
+            await conn.execute("SET LOCAL enable_seqscan = off")
+            raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+        scans = list(_scans(plan))
+        report.append((name, all(node != "Seq Scan" for node, _, _ in scans), scans))
+    return report
+
+
+# ================== CLI ==================
+# python migrations.py up | status | check | backfill
+async def _main(command):
+    await db.create_db_pool()
+    try:
+        if command == "up":
+            applied = await migrate()
+            print(f"Применено: {', '.join(map(str, applied))}" if applied else "Схема актуальна")
+            return 0
+        if command == "backfill":
+            print(f"entries: {await backfill_entries()} строк")
+            return 0
+        async with db.db_pool.acquire() as conn:
+            if command == "status":
+                done = await applied_versions(conn)
+                for version, name, _ in MIGRATIONS:
+                    mark = f"применена {done[version]:%d.%m.%Y %H:%M}" if version in done else "не применена"
+                    print(f"{version:>3} {name:<14} {mark}")
+                return 0
+            ok = True
+            for name, uses_index, scans in await check_plans(conn):
+                ok &= uses_index
+                detail = ", ".join(f"{node} {rel}" + (f" ({index})" if index else "") for node, rel, index in scans)
+                print(f"{'OK  ' if uses_index else 'SEQ '} {name}: {detail}")
+            return 0 if ok else 1
+    finally:
+        await db.close_db_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы БД дневника")
+    parser.add_argument("command", nargs="?", default="up", choices=("up", "status", "check", "backfill"),
+                        help="up — накатить, status — список версий, check — EXPLAIN горячих запросов, "
+                             "backfill — пересобрать ленту entries")
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(parser.parse_args().command)))
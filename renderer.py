@@ -0,0 +1,114 @@
+# ================== Карточка записи ==================
+# Шаблон карточки каждой категории собирается один раз при импорте: статичные куски между значениями
+# (подписи, разметка, переводы строк) уже готовы, при показе они не экранируются и не форматируются.
+# Карточка — один "".join кусков шаблона вперемешку с экранированными значениями, без промежуточных строк.
+# Бот работает с parse_mode="HTML" — всё, что ввёл пользователь, экранируется (_escape).
+
+# Лимит Telegram на текст сообщения (считается в UTF-16)
+MESSAGE_LIMIT = 4096
+# Заголовок в карточке не режем между страницами — слишком длинный укорачиваем (считается уже экранированным)
+TITLE_MAX_LEN = 1000
+EMPTY = "—"
+
+# (подпись, поле) — строки карточки по категориям, в порядке показа
+FIELDS = {
+    "spreads": (("❓ Вопрос", "question"), ("🃏 Карты", "cards"), ("📝 Трактовка", "interpretation")),
+    "dreams": (("💤 Сон", "dream_text"), ("📝 Трактовка", "interpretation")),
+    "premonitions": (("🔮 Предчувствие", "premonition_text"), ("📝 Трактовка", "interpretation")),
+    "rituals": (("🎯 Цель", "purpose"), ("🛠 Инструменты", "tools"), ("⚡ Действия", "action"),
+                ("💫 Ощущения", "feelings")),
+}
+
+_TITLE_OPEN = "📌 <b>"
+_TITLE_CLOSE = "</b>\n🗓 Дата: "
+# datetime.strftime заметно дороже форматирования полей вручную
+_DATE = "%02d.%02d.%d %02d:%02d"
+_RESULT = "\n🎯 Итог: "
+
+
+def _compile(fields):
+    """((кусок перед значением, поле), ...) — кусок закрывает предыдущую строку и открывает подпись"""
+    return tuple((f"\n{label}: ", key) for label, key in fields)
+
+
+TEMPLATES = {table: _compile(fields) for table, fields in FIELDS.items()}
+
+
+def _escape(text):
+    """html.escape(quote=False) с быстрым путём: в большинстве записей спецсимволов нет вовсе"""
+    if "&" in text or "<" in text or ">" in text:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return text
+
+
+def _text(value):
+    return EMPTY if value is None else _escape(str(value))
+
+
+def _title(record):
+    # <b> должен открываться и закрываться на одной строке — страницы режутся по строкам
+    title = _escape((record.get("title") or "Без названия").replace("\n", " "))
+    if len(title) > TITLE_MAX_LEN:
+        # лимит — на экранированный текст (& → &amp; в пять раз длиннее); сущность пополам не режем
+        cut = TITLE_MAX_LEN
+        amp = title.rfind("&", cut - 4, cut)
+        if amp != -1 and title.find(";", amp, cut) == -1:
+            cut = amp
+        title = title[:cut] + "…"
+    return title
+
+
+def render_record(record, table, result=None) -> str:
+    """Карточка записи одной строкой HTML (может быть длиннее лимита, см. render_record_pages)"""
+    created = record["created_at"]
+    parts = [_TITLE_OPEN, _title(record), _TITLE_CLOSE,
+             _DATE % (created.day, created.month, created.year, created.hour, created.minute)]
+    for joint, key in TEMPLATES.get(table, ()):
+        parts += (joint, _text(record.get(key)))
+    parts.append("\n")
+    if result:
+        parts += (_RESULT, _text(result.get("result_text")))
+    return "".join(parts)
+
+
+def render_record_pages(record, table, result=None, limit=MESSAGE_LIMIT) -> list[str]:
+    return split_pages(render_record(record, table, result), limit)
+
+
+def render_result_pages(result_text, limit=MESSAGE_LIMIT) -> list[str]:
+    return split_pages(f"<b>Итог:</b>\n{_text(result_text)}", limit)
+
+
+# ================== Разбиение на страницы ==================
+def _utf16_len(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_pages(text: str, limit=MESSAGE_LIMIT) -> list[str]:
+    """
+    Режет готовый HTML на куски не длиннее limit: по переводу строки, иначе по пробелу,
+    в крайнем случае — посреди слова, но не внутри сущности вроде &amp;.
+    Теги есть только в строке заголовка, а она всегда короче лимита.
+    """
+    if len(text) <= limit // 2:
+        return [text]
+
+    pages = []
+    while True:
+        # символы вне BMP (эмодзи) занимают в UTF-16 по две единицы: на каждый такой — на символ меньше
+        head = text[:limit]
+        window = limit - (_utf16_len(head) - len(head))
+        if len(text) <= window:
+            pages.append(text)
+            return pages
+
+        cut = text.rfind("\n", 0, window + 1)
+        if cut < window // 2:
+            cut = text.rfind(" ", 0, window + 1)
+        if cut < window // 2:
+            cut = window
+            amp = text.rfind("&", max(0, cut - 8), cut)
+            if amp != -1 and text.find(";", amp, cut) == -1:
+                cut = amp
+        pages.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n ")
@@ -0,0 +1,60 @@
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Hashable
+
+from metrics import SINGLEFLIGHT_SHARED, SINGLEFLIGHT_SUPERSEDED
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых загрузок: пока идёт загрузка по ключу, повторные вызовы с тем же ключом
+    ждут её результат, а не идут в БД сами.
+
+    Поколения по пользователю: каждый показ списка берёт билет (begin), и результат показывает
+    (и сохраняет в USER_CONTEXT) только обладатель последнего билета — какая бы загрузка ни закончилась
+    последней, на экране и в контексте остаётся то, что пользователь запросил последним.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[Hashable, asyncio.Task] = {}
+        # user_id → последний выданный билет; запись живёт, пока у пользователя есть незавершённый показ
+        self._latest: dict[int, int] = {}
+        self._tickets = itertools.count(1)
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._landed(key, t))
+        else:
+            SINGLEFLIGHT_SHARED.labels(self.name).inc()
+        # shield: отменённый вызывающий не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    def _landed(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # если все ждавшие отменены, исключение иначе ушло бы в лог как «never retrieved»
+        if not task.cancelled():
+            task.exception()
+
+    # ================== Поколения ==================
+    def begin(self, user_id: int) -> int:
+        ticket = next(self._tickets)
+        self._latest[user_id] = ticket
+        return ticket
+
+    def is_latest(self, user_id: int, ticket: int) -> bool:
+        if self._latest.get(user_id) == ticket:
+            return True
+        SINGLEFLIGHT_SUPERSEDED.labels(self.name).inc()
+        return False
+
+    def end(self, user_id: int, ticket: int):
+        if self._latest.get(user_id) == ticket:
+            del self._latest[user_id]
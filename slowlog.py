@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+from datetime import datetime
+
+import db
+
+logger = logging.getLogger("slow_query")
+
+# Порог медленного запроса, мс (0 — журнал выключен)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Доля медленных запросов, для которых снимаем EXPLAIN (ANALYZE, BUFFERS); 0 — не снимаем
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0"))
+# Кольцевой буфер планов на диске: каталог и сколько последних файлов хранить
+SLOW_QUERY_DIR = os.getenv("SLOW_QUERY_DIR", "slow_plans")
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "200"))
+# EXPLAIN ANALYZE выполняет запрос ещё раз — не даём ему висеть дольше этого
+EXPLAIN_TIMEOUT_MS = 10_000
+
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+# ================== Нормализация ==================
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(query, limit=500):
+    """Литералы → ?, пробелы схлопнуты: одинаковые запросы пишутся в журнал одинаково"""
+    query = _SPACES.sub(" ", _NUMBER.sub("?", _STRING.sub("?", query))).strip()
+    return query if len(query) <= limit else query[:limit] + "…"
+
+
+def arg_shape(value):
+    """Тип и размер аргумента — без самого значения (в аргументах тексты пользователей)"""
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (list, tuple)):
+        inner = sorted({arg_shape(v).split("[")[0] for v in value[:10]}) or ["?"]
+        return f"{type(value).__name__}[{'|'.join(inner)};{len(value)}]"
+    return type(value).__name__
+
+
+def row_count(method, result):
+    if method == "fetch":
+        return len(result) if result is not None else 0
+    if method == "fetchrow":
+        return int(result is not None)
+    if method == "execute" and isinstance(result, str):
+        # статус вида "UPDATE 3" / "INSERT 0 1"
+        tail = result.rsplit(" ", 1)[-1]
+        return int(tail) if tail.isdigit() else None
+    return None
+
+
+# ================== Кольцевой буфер планов ==================
+def _write_plan(directory, keep, entry):
+    os.makedirs(directory, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{entry['statement'].replace(':', '_')}.json"
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False, indent=2, default=str)
+    files = sorted(f for f in os.listdir(directory) if f.endswith(".json"))
+    for old in files[:max(0, len(files) - keep)]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except OSError:
+            pass
+
+
+class SlowQueryLog:
+    """Наблюдатель db.QUERY_OBSERVERS: журнал медленных запросов и выборочный EXPLAIN"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, explain_rate=SLOW_QUERY_EXPLAIN_RATE,
+                 directory=SLOW_QUERY_DIR, keep=SLOW_QUERY_KEEP):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.directory = directory
+        self.keep = keep
+        self.slow = 0
+        self.explained = 0
+        self._explaining = False  # не больше одного EXPLAIN за раз: он сам занимает соединение
+        # event loop держит на задачи только слабые ссылки — без своей незавершённый EXPLAIN может
+        # собрать GC, и _explaining так и останется True
+        self._tasks: set[asyncio.Task] = set()
+
+    def __call__(self, query, method, args, result, seconds, error):
+        if seconds < self.threshold:
+            return
+        self.slow += 1
+        statement = db.statement_name(query)
+        shapes = [] if method == "executemany" else [arg_shape(a) for a in args]
+        logger.warning("slow query %s %.1f ms %s rows=%s args=(%s)%s: %s",
+                       statement, seconds * 1000, method, row_count(method, result), ", ".join(shapes),
+                       f" error={type(error).__name__}" if error is not None else "", normalize_sql(query))
+
+        if (self.explain_rate and not self._explaining and error is None and method != "executemany"
+                and query.lstrip().upper().startswith(_EXPLAINABLE) and random.random() < self.explain_rate):
+            self._explaining = True
+            task = asyncio.get_running_loop().create_task(self._explain(statement, query, args, seconds, shapes))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _explain(self, statement, query, args, seconds, shapes):
+        try:
+            async with db.db_pool.acquire() as conn:
+                tr = conn.transaction()
+                await tr.start()
+                try:
+                    # ANALYZE действительно выполняет запрос — изменения откатываем
+                    await conn.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                    raw = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args)
+                finally:
+                    await tr.rollback()
+            entry = {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "statement": statement,
+                "ms": round(seconds * 1000, 2),
+                "args": shapes,
+                "sql": normalize_sql(query, limit=10_000),
+                "plan": json.loads(raw) if isinstance(raw, str) else raw,
+            }
+            await asyncio.to_thread(_write_plan, self.directory, self.keep, entry)
+            self.explained += 1
+        except Exception:
+            logger.exception("EXPLAIN for %s failed", statement)
+        finally:
+            self._explaining = False
+
+
+def setup_slow_query_log(**kwargs) -> SlowQueryLog | None:
+    """Подписывает журнал на запросы db.py; при SLOW_QUERY_MS=0 ничего не делает"""
+    log = SlowQueryLog(**kwargs)
+    if log.threshold <= 0:
+        return None
+    db.QUERY_OBSERVERS.append(log)
+    return log
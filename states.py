@@ -37,3 +37,6 @@ class Form(StatesGroup):
 
     # ================== Поиск ==================
     search_word = State()  # Для ввода слова при поиске
+
+    # ================== Импорт ==================
+    import_file = State()  # Ожидание файла CSV/JSONL для импорта
@@ -0,0 +1,207 @@
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import db
+from context_store import ContextStore, NavItem, UserContext, context_store_from_env
+
+# memory — всё в процессе (один воркер), redis — общий Redis, postgres — таблицы в той же БД
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CONTEXT_TTL = int(os.getenv("CONTEXT_TTL", "3600"))
+
+
+# ================== Сериализация контекста ==================
+def dump_context(items, page) -> str:
+    return json.dumps({
+        "items": [[i.table, i.id, i.title, i.created_at.isoformat()] for i in items],
+        "page": list(page) if page else None,
+    }, ensure_ascii=False)
+
+
+def load_context(raw, expires_at=0) -> UserContext:
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    payload = json.loads(raw) if isinstance(raw, str) else raw
+    items = [NavItem(table, rec_id, title, datetime.fromisoformat(created_at))
+             for table, rec_id, title, created_at in payload["items"]]
+    page = tuple(payload["page"]) if payload.get("page") else None
+    return UserContext(items, page, expires_at)
+
+
+# ================== Контекст навигации: бэкенды ==================
+class MemoryContextBackend:
+    """Асинхронная обёртка над ContextStore — один процесс"""
+
+    def __init__(self, store: ContextStore):
+        self.store = store
+
+    async def get(self, user_id) -> UserContext | None:
+        return self.store.get(user_id)
+
+    async def set(self, user_id, rows, page=None) -> UserContext:
+        return self.store.set(user_id, rows, page)
+
+    async def pop_item(self, user_id, index):
+        return self.store.pop_item(user_id, index)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+class RedisContextBackend:
+    """
+    Контекст в Redis: ключ ctx:{user_id} с TTL.
+    redis — любой клиент с API redis.asyncio (в т.ч. локальная подмена для тестов).
+    """
+
+    def __init__(self, redis, ttl=CONTEXT_TTL, prefix="ctx"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    async def get(self, user_id) -> UserContext | None:
+        raw = await self.redis.get(self._key(user_id))
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return load_context(raw)
+
+    async def set(self, user_id, rows, page=None) -> UserContext:
+        items = [row if isinstance(row, NavItem) else NavItem.from_row(row) for row in rows]
+        await self.redis.set(self._key(user_id), dump_context(items, page), ex=self.ttl)
+        return UserContext(items, page, 0)
+
+    async def pop_item(self, user_id, index):
+        ctx = await self.get(user_id)
+        if ctx is None or not 0 <= index < len(ctx.items):
+            return None
+        item = ctx.items.pop(index)
+        await self.redis.set(self._key(user_id), dump_context(ctx.items, ctx.page), ex=self.ttl)
+        return item
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class PgContextBackend:
+    """Контекст в таблице nav_context через общий пул db.py"""
+
+    # раз в столько записей чистим протухшие строки
+    CLEANUP_EVERY = 100
+
+    def __init__(self, ttl=CONTEXT_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    async def get(self, user_id) -> UserContext | None:
+        row = await db.fetchrow(
+            "SELECT payload::text AS payload FROM nav_context WHERE user_id=$1 AND expires_at > now()",
+            user_id
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return load_context(row["payload"])
+
+    async def set(self, user_id, rows, page=None) -> UserContext:
+        items = [row if isinstance(row, NavItem) else NavItem.from_row(row) for row in rows]
+        await db.execute(
+            "INSERT INTO nav_context(user_id, payload, expires_at) "
+            "VALUES($1, $2::jsonb, now() + make_interval(secs => $3::int)) "
+            "ON CONFLICT (user_id) DO UPDATE SET payload=EXCLUDED.payload, expires_at=EXCLUDED.expires_at",
+            user_id, dump_context(items, page), self.ttl
+        )
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY == 0:
+            await db.execute("DELETE FROM nav_context WHERE expires_at <= now()")
+        return UserContext(items, page, 0)
+
+    async def pop_item(self, user_id, index):
+        if index < 0:
+            return None
+        # jsonb "-" по индексу удаляет элемент массива — без чтения-записи на стороне бота
+        row = await db.fetchrow(
+            "UPDATE nav_context n SET payload=jsonb_set(n.payload, '{items}', (n.payload->'items') - $2::int) "
+            "FROM nav_context old "
+            "WHERE n.user_id=$1 AND old.user_id=n.user_id AND n.expires_at > now() "
+            "AND $2::int < jsonb_array_length(n.payload->'items') "
+            "RETURNING (old.payload->'items'->$2::int)::text AS item",
+            user_id, index
+        )
+        if row is None:
+            return None
+        table, rec_id, title, created_at = json.loads(row["item"])
+        return NavItem(table, rec_id, title, datetime.fromisoformat(created_at))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# ================== FSM в PostgreSQL ==================
+class PgStorage(BaseStorage):
+    """FSM-хранилище aiogram в таблице fsm_storage (создаётся migrations.py) через общий пул db.py"""
+
+    def __init__(self, key_builder=None):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await db.execute(
+            "INSERT INTO fsm_storage(key, state) VALUES($1, $2) "
+            "ON CONFLICT (key) DO UPDATE SET state=EXCLUDED.state",
+            self.key_builder.build(key), value
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await db.fetchrow("SELECT state FROM fsm_storage WHERE key=$1", self.key_builder.build(key))
+        return row["state"] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await db.execute(
+            "INSERT INTO fsm_storage(key, data) VALUES($1, $2::jsonb) "
+            "ON CONFLICT (key) DO UPDATE SET data=EXCLUDED.data",
+            self.key_builder.build(key), json.dumps(dict(data), ensure_ascii=False)
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await db.fetchrow("SELECT data::text AS data FROM fsm_storage WHERE key=$1",
+                                self.key_builder.build(key))
+        return json.loads(row["data"]) if row else {}
+
+    async def close(self) -> None:
+        # пул закрывается вместе с ботом, своих соединений нет
+        pass
+
+
+# ================== Выбор бэкенда ==================
+def create_storages(backend=STORAGE_BACKEND, redis=None):
+    """
+    Возвращает (FSM-хранилище для Dispatcher, хранилище контекста навигации).
+    redis — готовый клиент (например, подмена в тестах); иначе создаётся по REDIS_URL.
+    """
+    if backend == "memory":
+        return MemoryStorage(), MemoryContextBackend(context_store_from_env())
+    if backend == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        if redis is None:
+            from redis.asyncio import Redis
+            redis = Redis.from_url(REDIS_URL)
+        return RedisStorage(redis=redis), RedisContextBackend(redis)
+    if backend == "postgres":
+        return PgStorage(), PgContextBackend()
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+from callbacks import PartCb, RecCb
+from functions import MAX_ID, decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2024, 3, 1, 21, 30),
+    datetime(1970, 1, 1),
+    datetime(1969, 12, 31, 23, 0),
+    datetime(1965, 1, 1, 10, 0, 0, 123456),
+    datetime(1, 1, 1),
+    datetime(9999, 12, 31, 23, 59, 59, 999999),
+])
+@pytest.mark.parametrize("record_id", [1, 36, MAX_ID])
+@pytest.mark.parametrize("table", ["spreads", "rituals"])
+def test_cursor_round_trip(created_at, record_id, table):
+    cursor = encode_cursor(created_at, record_id, table)
+    assert len(f"n:1:{cursor}:{cursor}") <= 64
+    assert decode_cursor(cursor) == (created_at, record_id, table)
+
+
+@pytest.mark.parametrize("value", [
+    "", "abc", "1_2", "1_2_x", "1_2_s_s", "zz__s", "_1_s", "1_0_s", "1_-1_s",
+    encode_cursor(datetime(2024, 1, 1), MAX_ID + 1, "dreams"), "1_zzzzzzzzzzzzzzzzzzzz_s", "zzzzzzzzzzzzzzzzzzzz_1_s",
+])
+def test_cursor_rejects_garbage(value):
+    with pytest.raises(ValueError):
+        decode_cursor(value)
+
+
+@pytest.mark.parametrize("data", [f"r:v:s:{MAX_ID + 1}:", "r:v:s:0:", "pt:s:5:-1:", "pt:s:99999999999999999999:0:"])
+def test_callback_ids_bounded(data):
+    factory = RecCb if data.startswith("r:") else PartCb
+    with pytest.raises(ValueError):
+        factory.unpack(data)
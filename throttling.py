@@ -0,0 +1,131 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+from metrics import THROTTLED, THROTTLE_USERS
+
+# Токенов в секунду на пользователя (0 — без ограничений) и сколько нажатий подряд пропускаем сразу
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+
+THROTTLED_TEXT = "Слишком часто, подождите секунду ⏳"
+
+# Ограничиваем только то, что может привести к запросам в БД
+_THROTTLED_TYPES = ("message", "callback_query")
+
+
+class Bucket:
+    """Ведро токенов одного пользователя"""
+    __slots__ = ("tokens", "updated_at", "warned")
+
+    def __init__(self, tokens, updated_at):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.warned = False
+
+
+class TokenBuckets:
+    """
+    Вёдра токенов по user_id.
+    Ведро, простоявшее burst / rate секунд, снова полное — то же, что новое, поэтому его выбрасываем:
+    в памяти только пользователи, активные за последние несколько секунд.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.idle = burst / rate if rate > 0 else 0
+        self._clock = clock
+        # порядок — по последнему обращению: простаивающие всегда в начале
+        self._buckets: OrderedDict[int, Bucket] = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, user_id) -> Bucket | None:
+        """Списывает токен; None — токенов нет, апдейт надо отбросить"""
+        now = self._clock()
+        self._evict_idle(now)
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = Bucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(user_id)
+
+        if bucket.tokens < 1:
+            return None
+        bucket.tokens -= 1
+        bucket.warned = False
+        return bucket
+
+    def warn_once(self, user_id) -> bool:
+        """True только для первого отброшенного сообщения подряд — отвечаем один раз, а не на каждое"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket.warned:
+            return False
+        bucket.warned = True
+        return True
+
+    def _evict_idle(self, now):
+        while self._buckets:
+            user_id, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated_at < self.idle:
+                break
+            del self._buckets[user_id]
+            self.evictions += 1
+
+
+# ================== Middleware ==================
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на dp.update, стоит раньше FSM (при STORAGE_BACKEND=postgres
+    чтение состояния — уже запрос к БД): лишние нажатия отбрасываются до хранилищ и обработчиков.
+    """
+
+    def __init__(self, buckets: TokenBuckets):
+        self.buckets = buckets
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        update_type = event.event_type
+        user = data.get("event_from_user")
+        if update_type not in _THROTTLED_TYPES or user is None or self.buckets.take(user.id) is not None:
+            return await handler(event, data)
+
+        THROTTLED.labels(update_type).inc()
+        if update_type == "callback_query":
+            # ответить всё равно нужно — иначе у кнопки крутятся «часики»
+            await event.callback_query.answer(THROTTLED_TEXT)
+        elif self.buckets.warn_once(user.id):
+            await event.message.answer(THROTTLED_TEXT)
+        return None
+
+
+def setup_throttling(dp: Dispatcher, rate=THROTTLE_RATE, burst=THROTTLE_BURST) -> TokenBuckets | None:
+    """Ставит ThrottlingMiddleware перед FSMContextMiddleware; rate=0 — ничего не делает"""
+    if rate <= 0:
+        return None
+    buckets = TokenBuckets(rate, burst)
+    THROTTLE_USERS.set_function(lambda: len(buckets))
+    insert_before_fsm(dp, ThrottlingMiddleware(buckets))
+    return buckets
+
+
+def insert_before_fsm(dp: Dispatcher, middleware: BaseMiddleware):
+    """Внешний middleware на dp.update сразу перед FSMContextMiddleware (после уже вставленных так же)"""
+    # у менеджера middleware нет insert: снимаем FSM и всё, что после него, и вешаем обратно за новым
+    manager = dp.update.outer_middleware
+    tail = list(manager[manager.index(dp.fsm):]) if dp.fsm in manager else []
+    for registered in tail:
+        manager.unregister(registered)
+    manager(middleware)
+    for registered in tail:
+        manager(registered)
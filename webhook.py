@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Публичный адрес, который получит Telegram (без пути): https://bot.example.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Telegram присылает его в X-Telegram-Bot-Api-Secret-Token; чужие запросы получат 401. Обязателен:
+# без него любой, кто знает адрес, может присылать боту поддельные апдейты от имени разрешённых пользователей
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# Сколько ждать обработки уже принятых апдейтов при остановке
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "10"))
+
+
+class GracefulRequestHandler(SimpleRequestHandler):
+    """Перед закрытием сессии бота дожидается апдейтов, которые ещё обрабатываются в фоне"""
+
+    async def close(self) -> None:
+        pending = list(self._background_feed_update_tasks)
+        if pending:
+            logger.info("waiting for %s in-flight updates", len(pending))
+            await asyncio.wait(pending, timeout=SHUTDOWN_TIMEOUT)
+        await super().close()
+
+
+async def health(request: web.Request) -> web.Response:
+    """200, если пул жив и БД отвечает; иначе 503"""
+    try:
+        if db.db_pool is None:
+            raise RuntimeError("no pool")
+        await db.fetchrow("SELECT 1 AS ok")
+    except Exception:
+        # подробности — только в лог: /healthz открыт наружу
+        logger.exception("health check failed")
+        return web.json_response({"status": "error"}, status=503)
+    return web.json_response({"status": "ok"})
+
+
+def build_app(dp: Dispatcher, bot: Bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+              url=WEBHOOK_URL) -> web.Application:
+    """
+    aiohttp-приложение: POST {path} — апдейты от Telegram, GET /healthz — проверка.
+    Старт/остановка приложения запускают startup/shutdown хуки Dispatcher (пул БД и т.п.).
+    url=None — вебхук в Telegram не регистрируем (например, в тестах). Без secret не запускаемся.
+    """
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET не задан — без него режим webhook не запускается")
+    app = web.Application()
+    app.router.add_get("/healthz", health)
+    GracefulRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    if url:
+        async def set_webhook(_app):
+            await bot.set_webhook(f"{url.rstrip('/')}{path}", secret_token=secret,
+                                  allowed_updates=dp.resolve_used_update_types())
+        app.on_startup.append(set_webhook)
+    return app
+
+
+def run_webhook(dp: Dispatcher, bot: Bot):
+    # run_app сам ловит SIGINT/SIGTERM и проходит on_shutdown
+    web.run_app(build_app(dp, bot), host=WEBAPP_HOST, port=WEBAPP_PORT)